@@ -504,9 +504,10 @@ class GFlowNetAgent:
         backward: bool = False,
     ):
         """
-        Executes the actions on the environments envs, one by one. This method simply
-        calls env.step(action) or env.step_backwards(action) for each (env, action)
-        pair, depending on thhe value of backward.
+        Executes the actions on the environments envs. This method calls
+        env.step_batch(), which by default calls env.step(action) or
+        env.step_backwards(action) for each (env, action) pair, depending on the
+        value of backward.
 
         Args
         ----
@@ -522,14 +523,7 @@ class GFlowNetAgent:
         assert len(envs) == len(actions)
         if not isinstance(envs, list):
             envs = [envs]
-        if backward:
-            _, actions, valids = zip(
-                *[env.step_backwards(action) for env, action in zip(envs, actions)]
-            )
-        else:
-            _, actions, valids = zip(
-                *[env.step(action) for env, action in zip(envs, actions)]
-            )
+        _, actions, valids = self.env.step_batch(envs, actions, backward)
         return envs, actions, valids
 
     @torch.no_grad()
@@ -1205,9 +1199,25 @@ class GFlowNetAgent:
             rewards = rewards.tolist()
             logrewards = logrewards.tolist()
             actions_trajectories = batch.get_actions_trajectories()
-            self.buffer.add(states_term, actions_trajectories, logrewards, it)
-            self.buffer.add(
-                states_term, actions_trajectories, logrewards, it, buffer="replay"
+            # The readable representations are computed once for both buffers
+            states_readable = [self.env.state2readable(s) for s in states_term]
+            trajs_readable = [self.env.traj2readable(t) for t in actions_trajectories]
+            self.buffer.add_preformatted(
+                states_term,
+                actions_trajectories,
+                states_readable,
+                trajs_readable,
+                logrewards,
+                it,
+            )
+            self.buffer.add_preformatted(
+                states_term,
+                actions_trajectories,
+                states_readable,
+                trajs_readable,
+                logrewards,
+                it,
+                buffer="replay",
             )
             t1_buffer = time.time()
             times.update({"buffer": t1_buffer - t0_buffer})
@@ -14,16 +14,50 @@ import matplotlib.pyplot as plt
 import numpy as np
 import numpy.typing as npt
 import torch
-from torch.distributions import Categorical
 from torchtyping import TensorType
 
-from gflownet.utils.common import copy, set_device, set_float_precision, tbool, tfloat
+from gflownet.utils.common import (
+    copy,
+    set_device,
+    set_float_precision,
+    tbool,
+    tfloat,
+    tlong,
+)
 
 CMAP = mpl.colormaps["cividis"]
 """
 Plotting colour map (cividis).
 """
 
+_TRAJ2READABLE_TABLE = str.maketrans({"(": "[", ")": "]", ",": None})
+"""
+Translation table used by traj2readable to convert tuples into bracketed lists.
+"""
+
+
+def _masked_log_softmax(
+    logits: torch.Tensor, mask: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """
+    Returns the log-softmax of the logits along the last dimension, after setting the
+    logits of the invalid actions (True in mask) to -inf. The input is not modified.
+
+    The logits and the mask have shape [n_states, policy_output_dim], as well as the
+    output.
+    """
+    if mask is not None:
+        logits = logits.masked_fill(mask, -torch.inf)
+    return torch.log_softmax(logits, dim=1)
+
+
+def _gather_indices(x: torch.Tensor, indices: torch.Tensor) -> torch.Tensor:
+    """
+    Returns x[i, indices[i]] for each row i of x, where x has shape
+    [n_states, policy_output_dim] and indices has shape [n_states].
+    """
+    return torch.gather(x, 1, indices.unsqueeze(1)).squeeze(1)
+
 
 class GFlowNetEnv:
     """
@@ -58,11 +92,18 @@ class GFlowNetEnv:
         self.logsoftmax = torch.nn.LogSoftmax(dim=1)
         # Action space
         self.action_space = self.get_action_space()
+        # Dictionary mapping each action to its (first) index in the action space
+        self._action_indices = {}
+        for idx, action in enumerate(self.action_space):
+            self._action_indices.setdefault(action, idx)
         self.action_space_torch = torch.tensor(
             self.action_space, device=self.device, dtype=self.float
         )
         self.action_space_dim = len(self.action_space)
         self.mask_dim = self.action_space_dim
+        # Default forward mask (all actions valid), copied by the base
+        # get_mask_invalid_actions_forward()
+        self._mask_invalid_actions_forward_default = [False] * self.action_space_dim
         # Max trajectory length
         self.max_traj_length = self.get_max_traj_length()
         # Policy outputs
@@ -97,7 +138,7 @@ class GFlowNetEnv:
 
         See: self.action2representative()
         """
-        return self.action_space.index(self.action2representative(action))
+        return self._action_indices[self.action2representative(action)]
 
     def actions2indices(
         self, actions: TensorType["batch_size", "action_dim"]
@@ -166,8 +207,11 @@ class GFlowNetEnv:
             - False otherwise.
         For continuous or hybrid environments, this mask corresponds to the discrete
         part of the action space.
+
+        The base implementation returns a copy of a default mask built once, so that
+        the returned list can be modified in place.
         """
-        return [False for _ in range(self.action_space_dim)]
+        return list(self._mask_invalid_actions_forward_default)
 
     def get_mask_invalid_actions_backward(
         self,
@@ -193,7 +237,7 @@ class GFlowNetEnv:
             _, parents_a = self.get_parents(state, done)
         mask = [True for _ in range(self.action_space_dim)]
         for pa in parents_a:
-            mask[self.action_space.index(pa)] = False
+            mask[self._action_indices[pa]] = False
         return mask
 
     def get_mask(
@@ -284,6 +328,10 @@ class GFlowNetEnv:
         action : tuple
             Action from the action space.
 
+        backward : bool
+            True if the checks are performed for a backward step, False (default) for
+            a forward step.
+
         skip_mask_check : bool
             If True, skip computing forward mask of invalid actions to check if the
             action is valid.
@@ -300,7 +348,7 @@ class GFlowNetEnv:
             Action index
         """
         # If action not found in action space raise an error
-        if action not in self.action_space:
+        if action not in self._action_indices:
             raise ValueError(
                 f"Tried to execute action {action} not present in action space."
             )
@@ -314,7 +362,7 @@ class GFlowNetEnv:
                 return False, self.state, action
         # If action is in invalid mask, step should not proceed.
         if not (self.skip_mask_check or skip_mask_check):
-            action_idx = self.action_space.index(action)
+            action_idx = self._action_indices[action]
             if backward:
                 if self.get_mask_invalid_actions_backward()[action_idx]:
                     return False, self.state, action
@@ -351,7 +399,7 @@ class GFlowNetEnv:
             False, if the action is not allowed for the current state, e.g. stop at the
             root state
         """
-        _, self.state, action = self._pre_step(action, skip_mask_check)
+        _, self.state, action = self._pre_step(action, skip_mask_check=skip_mask_check)
         return None, None, None
 
     def step_backwards(
@@ -388,7 +436,9 @@ class GFlowNetEnv:
         valid : bool
             False, if the action is not allowed for the current state.
         """
-        do_step, self.state, action = self._pre_step(action, True, skip_mask_check)
+        do_step, self.state, action = self._pre_step(
+            action, backward=True, skip_mask_check=skip_mask_check
+        )
         if not do_step:
             return self.state, action, False
         parents, parents_a = self.get_parents()
@@ -397,18 +447,64 @@ class GFlowNetEnv:
         self.n_actions += 1
         return self.state, action, True
 
+    def step_batch(
+        self,
+        envs: List["GFlowNetEnv"],
+        actions: List[Tuple],
+        backward: bool = False,
+    ) -> Tuple[List, List, List[bool]]:
+        """
+        Executes a batch of actions on a batch of environments.
+
+        The base implementation simply calls env.step(action) or
+        env.step_backwards(action) for each (env, action) pair. Environments whose
+        transitions can be computed for a whole batch of states at once may override
+        this method, provided the state, n_actions and done attributes of each
+        environment in envs are updated accordingly.
+
+        Args
+        ----
+        envs : list
+            A list of instances of the environment. They are modified in place.
+
+        actions : list
+            A list of actions to be executed on each env of envs.
+
+        backward : bool
+            True if the steps are backward. False (forward) by default.
+
+        Returns
+        -------
+        states : list
+            The state of each environment after executing the action.
+
+        actions : list
+            The action executed on each environment.
+
+        valids : list
+            For each environment, False if the action is not allowed for its state.
+        """
+        if backward:
+            results = [env.step_backwards(action) for env, action in zip(envs, actions)]
+        else:
+            results = [env.step(action) for env, action in zip(envs, actions)]
+        if len(results) == 0:
+            return [], [], []
+        states, actions, valids = zip(*results)
+        return list(states), list(actions), list(valids)
+
     # TODO: do not apply temperature here but before calling this method.
     # TODO: rethink whether sampling_method should be here.
     def sample_actions_batch(
         self,
-        policy_outputs: TensorType["n_states", "policy_output_dim"],
-        mask: Optional[TensorType["n_states", "policy_output_dim"]] = None,
+        policy_outputs: torch.Tensor,
+        mask: Optional[torch.Tensor] = None,
         states_from: Optional[List] = None,
         is_backward: Optional[bool] = False,
         sampling_method: Optional[str] = "policy",
         temperature_logits: Optional[float] = 1.0,
         max_sampling_attempts: Optional[int] = 10,
-    ) -> Tuple[List[Tuple], TensorType["n_states"]]:
+    ) -> Tuple[List[Tuple], torch.Tensor]:
         """
         Samples a batch of actions from a batch of policy outputs.
 
@@ -431,12 +527,14 @@ class GFlowNetEnv:
         Args
         ----
         policy_outputs : tensor
-            The output of the GFlowNet policy model.
+            The output of the GFlowNet policy model, with shape
+            [n_states, policy_output_dim].
 
         mask : tensor
-            The mask of invalid actions. For continuous or mixed environments, the mask
-            may be tensor with an arbitrary length contaning information about special
-            states, as defined elsewhere in the environment.
+            The mask of invalid actions, with shape [n_states, mask_dim]. For
+            continuous or mixed environments, the mask may be tensor with an arbitrary
+            length contaning information about special states, as defined elsewhere in
+            the environment.
 
         states_from : tensor
             The states originating the actions, in GFlowNet format. Ignored in discrete
@@ -453,12 +551,10 @@ class GFlowNetEnv:
             non-invalid actions are returned without getting stuck.
         """
         device = policy_outputs.device
-        ns_range = torch.arange(policy_outputs.shape[0], device=device)
         if sampling_method == "uniform":
             logits = torch.ones(policy_outputs.shape, dtype=self.float, device=device)
         elif sampling_method == "policy":
-            logits = policy_outputs.clone().detach()
-            logits /= temperature_logits
+            logits = policy_outputs.detach() / temperature_logits
         else:
             raise NotImplementedError(
                 f"Sampling method {sampling_method} is invalid. "
@@ -471,13 +567,18 @@ class GFlowNetEnv:
             All actions in the mask are invalid for some states in the batch.
             """
             )
-            logits[mask] = -torch.inf
-        else:
+        # The log-softmax is computed only once and used both to sample the actions
+        # and to obtain their log probabilities.
+        logprobs_all = _masked_log_softmax(logits, mask)
+        if mask is None:
             mask = torch.zeros(policy_outputs.shape, dtype=torch.bool, device=device)
+        # The actions are sampled directly from the probabilities with
+        # torch.multinomial, without building a Categorical distribution.
+        probs_all = torch.exp(logprobs_all)
         # Make sure that a valid action is sampled, otherwise throw an error.
         for _ in range(max_sampling_attempts):
-            action_indices = Categorical(logits=logits).sample()
-            if not torch.any(mask[ns_range, action_indices]):
+            action_indices = torch.multinomial(probs_all, num_samples=1).squeeze(1)
+            if not torch.any(_gather_indices(mask, action_indices)):
                 break
         else:
             raise ValueError(
@@ -487,19 +588,19 @@ class GFlowNetEnv:
             """
                 )
             )
-        logprobs = self.logsoftmax(logits)[ns_range, action_indices]
+        logprobs = _gather_indices(logprobs_all, action_indices)
         # Build actions
-        actions = [self.action_space[idx] for idx in action_indices]
+        actions = [self.action_space[idx] for idx in action_indices.tolist()]
         return actions, logprobs
 
     def get_logprobs(
         self,
-        policy_outputs: TensorType["n_states", "policy_output_dim"],
-        actions: TensorType["n_states", "actions_dim"],
-        mask: TensorType["batch_size", "policy_output_dim"] = None,
+        policy_outputs: torch.Tensor,
+        actions: torch.Tensor,
+        mask: torch.Tensor = None,
         states_from: Optional[List] = None,
         is_backward: bool = False,
-    ) -> TensorType["batch_size"]:
+    ) -> torch.Tensor:
         """
         Computes log probabilities of actions given policy outputs and actions. This
         implementation is generally valid for all discrete environments but continuous
@@ -508,16 +609,18 @@ class GFlowNetEnv:
         Args
         ----
         policy_outputs : tensor
-            The output of the GFlowNet policy model.
+            The output of the GFlowNet policy model, with shape
+            [n_states, policy_output_dim].
 
         mask : tensor
-            The mask of invalid actions. For continuous or mixed environments, the mask
-            may be tensor with an arbitrary length contaning information about special
-            states, as defined elsewhere in the environment.
+            The mask of invalid actions, with shape [n_states, mask_dim]. For
+            continuous or mixed environments, the mask may be tensor with an arbitrary
+            length contaning information about special states, as defined elsewhere in
+            the environment.
 
         actions : tensor
             The actions from each state in the batch for which to compute the log
-            probability.
+            probability, with shape [n_states, action_dim].
 
         states_from : tensor
             The states originating the actions, in GFlowNet format. Ignored in discrete
@@ -528,20 +631,13 @@ class GFlowNetEnv:
             (default). Ignored in discrete environments and only required in certain
             continuous environments.
         """
-        device = policy_outputs.device
-        ns_range = torch.arange(policy_outputs.shape[0]).to(device)
-        logits = policy_outputs.clone()
-        if mask is not None:
-            logits[mask] = -torch.inf
-        action_indices = (
-            torch.tensor(
-                [self.action_space.index(tuple(action.tolist())) for action in actions]
-            )
-            .to(int)
-            .to(device)
+        action_indices = tlong(
+            [self._action_indices[tuple(action)] for action in actions.tolist()],
+            device=policy_outputs.device,
+        )
+        return _gather_indices(
+            _masked_log_softmax(policy_outputs, mask), action_indices
         )
-        logprobs = self.logsoftmax(logits)[ns_range, action_indices]
-        return logprobs
 
     # TODO: add seed
     def step_random(self, backward: bool = False):
@@ -756,7 +852,7 @@ class GFlowNetEnv:
         """
         Converts a trajectory into a human-readable string.
         """
-        return str(traj).replace("(", "[").replace(")", "]").replace(",", "")
+        return str(traj).translate(_TRAJ2READABLE_TABLE)
 
     def reset(self, env_id: Union[int, str] = None):
         """
@@ -900,7 +996,8 @@ class GFlowNetEnv:
         self, traj_list, traj_actions_list, current_traj, current_actions
     ):
         """
-        Determines all trajectories leading to each state in traj_list, recursively.
+        Determines all trajectories leading to each state in traj_list, by traversing
+        the parents depth-first with an explicit stack.
 
         Args
         ----
@@ -924,15 +1021,18 @@ class GFlowNetEnv:
         traj_actions_list : list
             List of actions within each trajectory
         """
-        parents, parents_actions = self.get_parents(current_traj[-1], False)
-        if parents == []:
-            traj_list.append(current_traj)
-            traj_actions_list.append(current_actions)
-            return traj_list, traj_actions_list
-        for idx, (p, a) in enumerate(zip(parents, parents_actions)):
-            traj_list, traj_actions_list = self.get_trajectories(
-                traj_list, traj_actions_list, current_traj + [p], current_actions + [a]
-            )
+        stack = [(current_traj, current_actions)]
+        while stack:
+            traj, actions = stack.pop()
+            parents, parents_actions = self.get_parents(traj[-1], False)
+            if parents == []:
+                traj_list.append(traj)
+                traj_actions_list.append(actions)
+                continue
+            # Parents are pushed in reverse order so that trajectories are appended in
+            # the same order as a recursive traversal would append them.
+            for p, a in zip(reversed(parents), reversed(parents_actions)):
+                stack.append((traj + [p], actions + [a]))
         return traj_list, traj_actions_list
 
     @torch.no_grad()
@@ -994,7 +1094,7 @@ class GFlowNetEnv:
         # that are valid to both environments
         mask = [True] * self.mask_dim
         for action in actions_valid:
-            mask[self.action_space.index(action)] = False
+            mask[self._action_indices[action]] = False
         return mask
 
     @torch.no_grad()
@@ -1079,8 +1179,8 @@ class GFlowNetEnv:
             reward = energy_reward
         elif energy is None and reward is None:
             # TODO: fix this
-            x = torch.stack([self.state2proxy(s) for s in states])
-            energy = self.proxy(x.to(self.device)).cpu()
+            x = self.states2proxy(states)
+            energy = self.proxy(x).cpu()
             reward = self.proxy2reward(energy)
 
         assert energy is not None and reward is not None
@@ -590,12 +590,12 @@ class Composition(GFlowNetEnv):
         if self.done:
             return self.state, action, False
         # If action not found in action space raise an error
-        if action not in self.action_space:
+        if action not in self._action_indices:
             raise ValueError(
                 f"Tried to execute action {action} not present in action space."
             )
         else:
-            action_idx = self.action_space.index(action)
+            action_idx = self._action_indices[action]
         # If action is in invalid mask, exit immediately
         if self.get_mask_invalid_actions_forward()[action_idx]:
             return self.state, action, False
@@ -108,18 +108,16 @@ class Grid(GFlowNetEnv):
             - True if the forward action is invalid from the current state.
             - False otherwise.
         """
+        # The state is only read, so self.state is not copied
         if state is None:
-            state = self.state.copy()
+            state = self.state
         if done is None:
             done = self.done
         if done:
             return [True for _ in range(self.policy_output_dim)]
         mask = [False for _ in range(self.policy_output_dim)]
         for idx, action in enumerate(self.action_space[:-1]):
-            child = state.copy()
-            for dim, incr in enumerate(action):
-                child[dim] += incr
-            if any(el >= self.length for el in child):
+            if any(state[dim] + incr >= self.length for dim, incr in enumerate(action)):
                 mask[idx] = True
         return mask
 
@@ -230,8 +228,10 @@ class Grid(GFlowNetEnv):
         actions : list
             List of actions that lead to state for each parent in parents
         """
+        # The state is not modified and step() replaces self.state instead of
+        # modifying it in place, so self.state is not copied
         if state is None:
-            state = self.state.copy()
+            state = self.state
         if done is None:
             done = self.done
         if done:
@@ -280,7 +280,7 @@ class Grid(GFlowNetEnv):
         """
         # Generic pre-step checks
         do_step, self.state, action = self._pre_step(
-            action, skip_mask_check or self.skip_mask_check
+            action, skip_mask_check=(skip_mask_check or self.skip_mask_check)
         )
         if not do_step:
             return self.state, action, False
@@ -326,7 +326,7 @@ class HybridTorus(GFlowNetEnv):
         """
         device = policy_outputs.device
         n_states = policy_outputs.shape[0]
-        ns_range = torch.arange(n_states).to(device)
+        ns_range = torch.arange(n_states, device=device)
         # Sample dimensions
         if sampling_method == "uniform":
             logits_dims = torch.ones(n_states, self.policy_output_dim).to(device)
@@ -389,7 +389,7 @@ class HybridTorus(GFlowNetEnv):
         dimensions = torch.LongTensor([d.long() for d in dimensions]).to(device)
         angles = torch.FloatTensor(angles).to(device)
         n_states = policy_outputs.shape[0]
-        ns_range = torch.arange(n_states).to(device)
+        ns_range = torch.arange(n_states, device=device)
         # Dimensions
         logits_dims = policy_outputs[:, 0 :: self.n_params_per_dim]
         if mask is not None:
@@ -139,7 +139,7 @@ class Scrabble(GFlowNetEnv):
             return [False for _ in range(self.action_space_dim)]
         # Otherwise, only EOS is valid
         mask = [True for _ in range(self.action_space_dim)]
-        mask[self.action_space.index(self.eos)] = False
+        mask[self._action_indices[self.eos]] = False
         return mask
 
     def get_parents(
@@ -215,7 +215,7 @@ class Scrabble(GFlowNetEnv):
         """
         # Generic pre-step checks
         do_step, self.state, action = self._pre_step(
-            action, skip_mask_check or self.skip_mask_check
+            action, skip_mask_check=(skip_mask_check or self.skip_mask_check)
         )
         if not do_step:
             return self.state, action, False
@@ -425,7 +425,7 @@ class Tetris(GFlowNetEnv):
         """
         # Generic pre-step checks
         do_step, self.state, action = self._pre_step(
-            action, skip_mask_check or self.skip_mask_check
+            action, skip_mask_check=(skip_mask_check or self.skip_mask_check)
         )
         if not do_step:
             return self.state, action, False
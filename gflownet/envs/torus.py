@@ -97,8 +97,9 @@ class Torus(GFlowNetEnv):
         All actions except EOS are valid if the maximum number of actions has not been
         reached, and vice versa.
         """
+        # The state is only read, so self.state is not copied
         if state is None:
-            state = self.state.copy()
+            state = self.state
         if done is None:
             done = self.done
         if done:
@@ -162,9 +163,12 @@ class Torus(GFlowNetEnv):
         A tensor containing all the states in the batch.
         """
         states = tlong(states, device=self.device)
-        cols = states[:, :-1] + torch.arange(self.n_dim).to(self.device) * self.n_angles
+        cols = (
+            states[:, :-1]
+            + torch.arange(self.n_dim, device=self.device) * self.n_angles
+        )
         rows = torch.repeat_interleave(
-            torch.arange(states.shape[0]).to(self.device), self.n_dim
+            torch.arange(states.shape[0], device=self.device), self.n_dim
         )
         states_policy = torch.zeros(
             (states.shape[0], self.n_angles * self.n_dim + 1)
@@ -228,8 +232,10 @@ class Torus(GFlowNetEnv):
             List of actions that lead to state for each parent in parents
         """
 
+        # The state is not modified and step() replaces self.state instead of
+        # modifying it in place, so self.state is not copied
         if state is None:
-            state = self.state.copy()
+            state = self.state
         if done is None:
             done = self.done
         if done:
@@ -288,7 +294,7 @@ class Torus(GFlowNetEnv):
         """
         # Generic pre-step checks
         do_step, self.state, action = self._pre_step(
-            action, skip_mask_check or self.skip_mask_check
+            action, skip_mask_check=(skip_mask_check or self.skip_mask_check)
         )
         if not do_step:
             return self.state, action, False
@@ -300,7 +306,8 @@ class Torus(GFlowNetEnv):
             return self.state, self.eos, True
         # Perform non-EOS action
         else:
-            angles_next = self.state.copy()[: self.n_dim]
+            # Slicing already returns a new list
+            angles_next = self.state[: self.n_dim]
             for dim, incr in enumerate(action):
                 angles_next[dim] += incr
                 # If negative angle index, restart from the back
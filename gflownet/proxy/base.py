@@ -183,14 +183,52 @@ class Proxy(ABC):
             The log-reward of all elements in the batch.
         """
         logrewards = self._logreward_function(proxy_values)
+        logreward_min = self.get_min_reward(log=True)
         if self.do_clip_rewards:
-            logrewards = torch.clip(
-                logrewards, min=self.get_min_reward(log=True), max=None
-            )
-        logrewards[logrewards.isnan()] = self.get_min_reward(log=True)
-        logrewards[~logrewards.isfinite()] = self.get_min_reward(log=True)
+            logrewards = torch.clip(logrewards, min=logreward_min, max=None)
+        # NaN values are not finite, so a single pass sets both NaN and inf values
+        logrewards.masked_fill_(~torch.isfinite(logrewards), logreward_min)
         return logrewards
 
+    def reward_batch_torch(
+        self,
+        proxy_values: TensorType["batch_size"],
+        done: TensorType["batch_size"],
+        log: bool = False,
+    ) -> TensorType["batch_size"]:
+        """
+        Transform a tensor of proxy values into (log) rewards, only for the elements
+        selected by done. The rest of elements are assigned the minimum (log) reward.
+
+        The transformation is carried out with torch operations on the device of the
+        proxy values, so that batches already on the device are not moved.
+
+        Parameters
+        ----------
+        proxy_values : tensor
+            The proxy values corresponding to a batch of states. Only the values of the
+            elements selected by done are used.
+        done : tensor
+            Either a boolean mask or a long tensor with the indices of the elements
+            whose proxy values must be transformed, typically the terminating states
+            of a batch. Indices avoid the synchronisation of boolean indexing on
+            accelerators.
+        log : bool
+            If True, returns the logarithm of the rewards. If False (default), returns
+            the natural rewards.
+
+        Returns
+        -------
+        tensor
+            The reward or log-reward of all elements in the batch.
+        """
+        rewards = torch.full_like(proxy_values, self.get_min_reward(log))
+        if log:
+            rewards[done] = self.proxy2logreward(proxy_values[done])
+        else:
+            rewards[done] = self.proxy2reward(proxy_values[done])
+        return rewards
+
     def get_min_reward(self, log: bool = False) -> float:
         """
         Returns the minimum value of the (log) reward, retrieved from self.reward_min
@@ -327,37 +365,35 @@ class Proxy(ABC):
                 lambda x: torch.log(torch.abs(x)),
             )
 
+        # The transformations and their constants (for example, log(alpha)) are built
+        # once here, rather than every time the (log) reward function is called.
+        # Missing parameters take the same defaults as in the reward functions.
         elif reward_function.startswith("pow"):
-            return (
-                Proxy._power(**kwargs),
-                lambda x: torch.log(Proxy._power(**kwargs)(x)),
-            )
+            power = Proxy._power(**kwargs)
+            return power, lambda x: torch.log(power(x))
 
         elif reward_function.startswith("exp") or reward_function == "boltzmann":
-            return Proxy._exponential(**kwargs), lambda x: torch.log(
-                kwargs["alpha"]
-            ) + Proxy._product(beta=kwargs["beta"])(x)
+            log_alpha = torch.log(torch.as_tensor(kwargs.get("alpha", 1.0)))
+            product = Proxy._product(beta=kwargs.get("beta", 1.0))
+            return Proxy._exponential(**kwargs), lambda x: log_alpha + product(x)
 
         elif reward_function == "shift":
-            return (
-                Proxy._shift(**kwargs),
-                lambda x: torch.log(Proxy._shift(**kwargs)(x)),
-            )
+            shift = Proxy._shift(**kwargs)
+            return shift, lambda x: torch.log(shift(x))
 
         elif reward_function.startswith("prod"):
-            return (
-                Proxy._product(**kwargs),
-                lambda x: torch.log(Proxy._product(**kwargs)(x)),
-            )
+            product = Proxy._product(**kwargs)
+            return product, lambda x: torch.log(product(x))
         elif reward_function.lower().startswith("rbf_exp"):
+            log_alpha = torch.log(torch.as_tensor(kwargs.get("alpha", 1.0)))
+            product = Proxy._product(beta=kwargs.get("beta", 1.0))
+            distance = Proxy._distance(
+                center=kwargs.get("center", 0.0),
+                distance=kwargs.get("distance", "squared"),
+            )
             return (
                 Proxy._rbf_exponential(**kwargs),
-                lambda x: torch.log(kwargs["alpha"])
-                + Proxy._product(beta=kwargs["beta"])(
-                    Proxy._distance(
-                        center=kwargs["center"], distance=kwargs["distance"]
-                    )(x)
-                ),
+                lambda x: log_alpha + product(distance(x)),
             )
 
         else:
@@ -1,4 +1,5 @@
-from collections import OrderedDict
+import itertools
+import weakref
 from typing import List, Optional, Tuple, Union
 
 import numpy as np
@@ -11,7 +12,6 @@ from gflownet.proxy.base import Proxy
 from gflownet.utils.common import (
     concat_items,
     copy,
-    extend,
     set_device,
     set_float_precision,
     tbool,
@@ -19,6 +19,24 @@ from gflownet.utils.common import (
     tlong,
 )
 
+# Forward masks of the source state, as boolean tensors, of the (non-conditional)
+# environments passed to Batch.set_env(), indexed by environment and then by device.
+# Agents create several batches with the same environment at every iteration, and
+# this avoids computing and transferring the mask for every new batch.
+_SOURCE_MASK_CACHE = weakref.WeakKeyDictionary()
+
+
+def _concat(items: List[Union[List, TensorType["..."]]]) -> Union[List, TensorType]:
+    """
+    Concatenates a list of lists, tensors or arrays into a single list, tensor or
+    array.
+    """
+    if torch.is_tensor(items[0]):
+        return torch.cat(items)
+    if isinstance(items[0], np.ndarray):
+        return np.concatenate(items)
+    return list(itertools.chain.from_iterable(items))
+
 
 class Batch:
     """
@@ -74,10 +92,11 @@ class Batch:
         # Initialize batch size 0
         self.size = 0
         # Initialize empty batch variables
-        # TODO: make single ordered dictionary of dictionaries
-        self.envs = OrderedDict()
-        self.trajectories = OrderedDict()
-        self.is_backward = OrderedDict()
+        # TODO: make single dictionary of dictionaries
+        # Plain dictionaries preserve the insertion order of the trajectories
+        self.envs = {}
+        self.trajectories = {}
+        self.is_backward = {}
         self.traj_indices = []
         # TODO: state_indices is currently unused, it is redundant and inconsistent
         # between forward and backward trajectories. We may want to remove it.
@@ -85,8 +104,14 @@ class Batch:
         self.states = []
         self.actions = []
         self.done = []
+        # Tensors of the trajectory indices, state indices, actions and done flags,
+        # built on demand and reset whenever the lists above are modified
+        self._reset_cached_tensors()
         self.masks_invalid_actions_forward = []
         self.masks_invalid_actions_backward = []
+        # Masks as boolean tensors, built once all the masks have been computed
+        self._masks_forward_tensor = None
+        self._masks_backward_tensor = None
         self.parents = []
         self.parents_all = []
         self.parents_actions_all = []
@@ -106,6 +131,8 @@ class Batch:
         self._logrewards_parents_available = False
         self._logrewards_source_available = False
         self._proxy_values_available = False
+        # Whether the available proxy values include the non-terminating states
+        self._proxy_values_non_terminating = False
 
     def __len__(self):
         return self.size
@@ -113,7 +140,7 @@ class Batch:
     def batch_idx_to_traj_state_idx(self, batch_idx: int):
         traj_idx = self.traj_indices[batch_idx]
         state_idx = self.state_indices[batch_idx]
-        return traj_idx, state_id
+        return traj_idx, state_idx
 
     def traj_idx_to_batch_indices(self, traj_idx: int):
         batch_indices = self.trajectories[traj_idx]
@@ -137,7 +164,7 @@ class Batch:
         return self.trajectories[traj_idx][action_idx - 1]
 
     def idx2state_idx(self, idx: int):
-        return self.trajectories[self.traj_indices[idx]].index(idx)
+        return int(self._get_rows()["pos"][idx])
 
     def rewards_available(self, log: bool = False) -> bool:
         """
@@ -207,13 +234,39 @@ class Batch:
         self.env = env.copy().reset()
         self.source = {
             "state": self.env.source,
-            "mask_forward": tbool(
-                self.env.get_mask_invalid_actions_forward(), device=self.device
-            ),
+            "mask_forward": self._get_source_mask_forward(env),
         }
         self.conditional = self.env.conditional
         self.continuous = self.env.continuous
 
+    def _get_source_mask_forward(self, env: GFlowNetEnv) -> TensorType["mask_dim"]:
+        """
+        Returns the forward mask of invalid actions of the source state of self.env
+        as a boolean tensor on self.device.
+
+        The mask is cached for each environment instance passed to set_env() and
+        device, unless the environment is conditional.
+
+        Args
+        ----
+        env : GFlowNetEnv
+            The environment passed to set_env(), used as the key of the cache.
+
+        Returns
+        -------
+        The forward mask of the source state.
+        """
+        if self.env.conditional:
+            return tbool(
+                self.env.get_mask_invalid_actions_forward(), device=self.device
+            )
+        masks_by_device = _SOURCE_MASK_CACHE.setdefault(env, {})
+        if self.device not in masks_by_device:
+            masks_by_device[self.device] = tbool(
+                self.env.get_mask_invalid_actions_forward(), device=self.device
+            )
+        return masks_by_device[self.device]
+
     def set_proxy(self, proxy: Proxy):
         """
         Sets the proxy, used to compute rewards from a batch of states.
@@ -306,18 +359,30 @@ class Batch:
                     self.parents.append(
                         copy(self.states[self.trajectories[env.id][-2]])
                     )
-            # Set masks to None
-            self.masks_invalid_actions_forward.append(None)
+            # Set masks to None, except the forward mask of terminating states in
+            # forward trajectories, which is computed here while the env is at hand.
+            # The forward masks of the rest of states are typically computed (and
+            # stored) via get_item() when sampling the next action, so that after
+            # sampling forward trajectories all the forward masks are available.
+            if not backward and env.done:
+                self.masks_invalid_actions_forward.append(
+                    env.get_mask_invalid_actions_forward()
+                )
+            else:
+                self.masks_invalid_actions_forward.append(None)
             self.masks_invalid_actions_backward.append(None)
             # Increment size of batch
             self.size += 1
         # Other variables are not available after new items were added to the batch
+        self._reset_cached_tensors()
         self._masks_forward_available = False
         self._masks_backward_available = False
         self._parents_policy_available = False
         self._parents_all_available = False
         self._rewards_available = False
         self._logrewards_available = False
+        self._proxy_values_available = False
+        self._proxy_values_non_terminating = False
 
     def get_n_trajectories(self) -> int:
         """
@@ -332,7 +397,7 @@ class Batch:
     def get_unique_trajectory_indices(self) -> List:
         """
         Returns the unique trajectory indices as the keys of self.trajectories, which
-        is an OrderedDict, as a list.
+        preserves the insertion order, as a list.
         """
         return list(self.trajectories.keys())
 
@@ -347,7 +412,7 @@ class Batch:
         ----
         consecutive : bool
             If True, the trajectory indices are mapped to consecutive indices starting
-            from 0, in the order of the OrderedDict self.trajectory.keys(). If False
+            from 0, in the order of self.trajectories.keys(). If False
             (default), the trajectory indices are returned as they are.
 
         return_mapping_dict : bool
@@ -363,23 +428,45 @@ class Batch:
             A dictionary mapping the actual trajectory indices in the Batch to the
             consecutive indices. Ommited if return_mapping_dict is False (default).
         """
-        if consecutive:
+        if not consecutive:
+            if self._traj_indices_tensor is None:
+                self._traj_indices_tensor = tlong(self.traj_indices, device=self.device)
+            return self._traj_indices_tensor
+        if self._traj_indices_consecutive is None:
             traj_index_to_consecutive_dict = {
                 traj_idx: consecutive
                 for consecutive, traj_idx in enumerate(self.trajectories)
             }
-            traj_indices = list(
-                map(lambda x: traj_index_to_consecutive_dict[x], self.traj_indices)
+            traj_indices = tlong(
+                [traj_index_to_consecutive_dict[x] for x in self.traj_indices],
+                device=self.device,
             )
-        else:
-            traj_indices = self.traj_indices
-        if return_mapping_dict and consecutive:
-            return (
-                tlong(traj_indices, device=self.device),
+            self._traj_indices_consecutive = (
+                traj_indices,
                 traj_index_to_consecutive_dict,
             )
+        traj_indices, traj_index_to_consecutive_dict = self._traj_indices_consecutive
+        if return_mapping_dict:
+            return traj_indices, traj_index_to_consecutive_dict
         else:
-            return tlong(traj_indices, device=self.device)
+            return traj_indices
+
+    def _reset_cached_tensors(self):
+        """
+        Resets the cached tensors of trajectory indices, state indices, actions and
+        done flags, the cached per-state columns (see _get_rows()) and the cached
+        result of is_valid(), which must be done whenever self.traj_indices,
+        self.state_indices, self.trajectories, self.actions or self.done are modified.
+        """
+        self._is_valid = None
+        self._rows = None
+        self._traj_indices_tensor = None
+        self._traj_indices_consecutive = None
+        self._state_indices_tensor = None
+        self._actions_tensor = None
+        self._done_tensor = None
+        self._done_indices = None
+        self._terminating_indices_by_traj = None
 
     def get_state_indices(self) -> TensorType["n_states", int]:
         """
@@ -391,7 +478,9 @@ class Batch:
         state_indices : torch.tensor
             self.state_indices as a long int torch tensor.
         """
-        return tlong(self.state_indices, device=self.device)
+        if self._state_indices_tensor is None:
+            self._state_indices_tensor = tlong(self.state_indices, device=self.device)
+        return self._state_indices_tensor
 
     def get_states(
         self,
@@ -438,6 +527,50 @@ class Batch:
             return self.states2proxy()
         return self.states
 
+    def _split_by_trajectory(
+        self,
+        states: Union[List, TensorType["n_states", "..."], npt.NDArray],
+        traj_indices: Union[List, TensorType["n_states"]],
+    ) -> List[Tuple]:
+        """
+        Splits a set of states into groups of states of the same trajectory.
+
+        The states are grouped by sorting the trajectory indices once, instead of
+        comparing the whole set of trajectory indices with each trajectory index.
+
+        Args
+        ----
+        states : list or tensor or ndarray
+            A set of states in GFlowNet format.
+
+        traj_indices : list or tensor
+            The trajectory index of each state in states.
+
+        Returns
+        -------
+        A list of tuples (traj_idx, indices, states_traj), one per trajectory present
+        in traj_indices, where indices is a long tensor with the positions in states
+        of the states of trajectory traj_idx and states_traj contains such states, in
+        the same type as states.
+        """
+        traj_indices = tlong(traj_indices, device=self.device)
+        perm = torch.argsort(traj_indices, stable=True)
+        traj_indices_unique, counts = torch.unique_consecutive(
+            traj_indices[perm], return_counts=True
+        )
+        groups = []
+        for traj_idx, indices in zip(
+            traj_indices_unique.tolist(), torch.split(perm, counts.tolist())
+        ):
+            if torch.is_tensor(states):
+                states_traj = states[indices]
+            elif isinstance(states, np.ndarray):
+                states_traj = states[indices.cpu().numpy()]
+            else:
+                states_traj = [states[idx] for idx in indices.tolist()]
+            groups.append((traj_idx, indices, states_traj))
+        return groups
+
     def states2policy(
         self,
         states: Optional[Union[List[List], List[TensorType["n_states", "..."]]]] = None,
@@ -477,14 +610,13 @@ class Batch:
                 device=self.device,
                 dtype=self.float,
             )
-            traj_indices_torch = tlong(traj_indices, device=self.device)
-            for traj_idx in self.trajectories:
-                if traj_idx not in traj_indices:
-                    continue
-                states_policy[traj_indices_torch == traj_idx] = self.envs[
-                    traj_idx
-                ].statebatchpolicy(
-                    self.get_states_of_trajectory(traj_idx, states, traj_indices)
+            for traj_idx, indices, states_traj in self._split_by_trajectory(
+                states, traj_indices
+            ):
+                states_policy[indices] = tfloat(
+                    self.envs[traj_idx].states2policy(states_traj),
+                    device=self.device,
+                    float_type=self.float,
                 )
             return states_policy
         return self.env.states2policy(states)
@@ -528,21 +660,18 @@ class Batch:
             traj_indices = self.traj_indices
         if self.conditional:
             states_proxy = []
-            index = torch.arange(len(states), device=self.device)
             perm_index = []
-            # TODO: rethink this
-            for traj_idx in self.trajectories:
-                if traj_idx not in traj_indices:
-                    continue
-                states_proxy.append(
-                    self.envs[traj_idx].states2proxy(
-                        self.get_states_of_trajectory(traj_idx, states, traj_indices)
-                    )
-                )
-                perm_index.append(index[env_ids == env_id])
+            for traj_idx, indices, states_traj in self._split_by_trajectory(
+                states, traj_indices
+            ):
+                states_proxy.append(self.envs[traj_idx].states2proxy(states_traj))
+                perm_index.append(indices)
+            # perm_index[k] is the index in states of the k-th concatenated state in
+            # proxy format. The inverse permutation indexes the concatenated states
+            # in the order of states.
             perm_index = torch.cat(perm_index)
-            # Reverse permutation to make it index the states_proxy array
-            index[perm_index] = index.clone()
+            index = torch.empty_like(perm_index)
+            index[perm_index] = torch.arange(len(perm_index), device=self.device)
             states_proxy = concat_items(states_proxy, index)
             return states_proxy
         return self.env.states2proxy(states)
@@ -551,13 +680,46 @@ class Batch:
         """
         Returns the actions in the batch as a float tensor.
         """
-        return tfloat(self.actions, float_type=self.float, device=self.device)
+        if self._actions_tensor is None:
+            if self.device.type == "cuda":
+                # Stage the actions in page-locked host memory so that the transfer
+                # to the GPU is a single asynchronous copy
+                actions = tfloat(self.actions, float_type=self.float, device="cpu")
+                self._actions_tensor = actions.pin_memory().to(
+                    self.device, non_blocking=True
+                )
+            else:
+                self._actions_tensor = tfloat(
+                    self.actions, float_type=self.float, device=self.device
+                )
+        return self._actions_tensor
 
     def get_done(self) -> TensorType["n_states"]:
         """
         Returns the list of done flags as a boolean tensor.
+
+        The tensor is cached until the batch is modified (see _reset_cached_tensors()).
+        """
+        if self._done_tensor is None:
+            self._done_tensor = torch.as_tensor(
+                self.done, dtype=torch.bool, device=self.device
+            )
+        return self._done_tensor
+
+    def _get_done_indices(self) -> TensorType["n_done", int]:
+        """
+        Returns the indices in the batch of the states with done = True, as a long int
+        tensor. Indexing with these indices is cheaper than indexing with the boolean
+        tensor of done flags, which has to be converted into indices every time.
         """
-        return tbool(self.done, device=self.device)
+        if self._done_indices is None:
+            self._done_indices = torch.nonzero(self.get_done(), as_tuple=True)[0]
+            # Each trajectory has at most one terminating state. This is checked once
+            # here instead of every time the terminating states are retrieved.
+            assert len(self._done_indices) == len(
+                {self.traj_indices[idx] for idx in self._done_indices.tolist()}
+            ), "Some trajectories of the batch have more than one terminating state"
+        return self._done_indices
 
     # TODO: check availability one by one as in get_masks
     def get_parents(
@@ -631,38 +793,69 @@ class Batch:
 
         self._parents_available is set to True.
         """
-        self.parents = []
-        self.parents_indices = []
-
-        indices_dict = {}
-        indices_next = 0
-
-        # Iterate over the trajectories to obtain the parents from the states
-        for traj_idx, batch_indices in self.trajectories.items():
-            # parent is source
-            self.parents.append(self.envs[traj_idx].source)
-            # there's no source state in the batch
-            self.parents_indices.append(-1)
-            # parent is not source
-            # TODO: check if tensor and sort without iter
-            self.parents.extend([self.states[idx] for idx in batch_indices[:-1]])
-            self.parents_indices.extend(batch_indices[:-1])
-
-            # Store the indices required to reorder the parents lists in the same
-            # order as the states
-            for b_idx in batch_indices:
-                indices_dict[b_idx] = indices_next
-                indices_next += 1
-
-        # Sort parents list in the same order as states
-        # TODO: check if tensor and sort without iter
-        self.parents = [self.parents[indices_dict[idx]] for idx in range(len(self))]
-        self.parents_indices = tlong(
-            [self.parents_indices[indices_dict[idx]] for idx in range(len(self))],
-            device=self.device,
-        )
+        # The parent of each state and its index are written directly at the batch
+        # index of the state, so that no reordering is needed afterwards.
+        self.parents = [None] * len(self)
+
+        rows = self._get_rows()
+        for idx, (traj_idx, idx_parent) in enumerate(
+            zip(self.traj_indices, rows["parent"].tolist())
+        ):
+            if idx_parent == -1:
+                self.parents[idx] = self.envs[traj_idx].source
+            else:
+                self.parents[idx] = self.states[idx_parent]
+
+        self.parents_indices = tlong(rows["parent"], device=self.device)
         self._parents_available = True
 
+    def _get_rows(self) -> dict:
+        """
+        Returns the per-state columns of the batch, as a dictionary of arrays of length
+        n_states with the following keys:
+
+        - pos: the position of the state in its trajectory in self.trajectories.
+        - parent: the index in the batch of the parent of the state, or -1 if the
+          parent is the source state.
+
+        The columns are built from self.trajectories, by flattening the trajectories
+        into a single array of batch indices, in which the parent of each state is the
+        preceding element, except for the first state of each trajectory, whose parent
+        is the source. It is cached until the batch is modified. The trajectory
+        indices are not included because they are not necessarily integers.
+
+        Returns
+        -------
+        rows : dict
+            A dictionary of numpy arrays, with keys pos and parent.
+        """
+        if self._rows is not None:
+            return self._rows
+        lengths = np.fromiter(
+            map(len, self.trajectories.values()),
+            dtype=np.int64,
+            count=len(self.trajectories),
+        )
+        batch_indices = np.fromiter(
+            itertools.chain.from_iterable(self.trajectories.values()),
+            dtype=np.int64,
+            count=len(self),
+        )
+        # Position in batch_indices of the first state of each trajectory
+        starts = np.cumsum(lengths) - lengths
+        positions = np.arange(len(batch_indices)) - np.repeat(starts, lengths)
+        parents = np.empty(len(batch_indices), dtype=np.int64)
+        parents[1:] = batch_indices[:-1]
+        parents[starts] = -1
+        rows = {
+            "pos": np.empty(len(self), dtype=np.int64),
+            "parent": np.empty(len(self), dtype=np.int64),
+        }
+        rows["pos"][batch_indices] = positions
+        rows["parent"][batch_indices] = parents
+        self._rows = rows
+        return rows
+
     # TODO: consider converting directly from self.parents
     def _compute_parents_policy(self):
         """
@@ -679,19 +872,24 @@ class Batch:
         self._parents_policy_available is set to True.
         """
         self.states_policy = self.get_states(policy=True)
-        self.parents_policy = torch.zeros_like(self.states_policy)
-        # Iterate over the trajectories to obtain the parents from the states
-        for traj_idx, batch_indices in self.trajectories.items():
-            # parent is source
-            self.parents_policy[batch_indices[0]] = tfloat(
-                self.envs[traj_idx].state2policy(self.envs[traj_idx].source),
+        parents_indices = tlong(self._get_rows()["parent"], device=self.device)
+        # parent is not source: gather the parents from the states
+        self.parents_policy = self.states_policy[parents_indices.clamp(min=0)]
+        # parent is source
+        if self.conditional:
+            # The source must be converted by the environment of each trajectory
+            for traj_idx, batch_indices in self.trajectories.items():
+                self.parents_policy[batch_indices[0]] = tfloat(
+                    self.envs[traj_idx].state2policy(self.envs[traj_idx].source),
+                    device=self.device,
+                    float_type=self.float,
+                )
+        else:
+            self.parents_policy[parents_indices == -1] = tfloat(
+                self.env.state2policy(self.env.source),
                 device=self.device,
                 float_type=self.float,
             )
-            # parent is not source
-            self.parents_policy[batch_indices[1:]] = self.states_policy[
-                batch_indices[:-1]
-            ]
         self._parents_policy_available = True
 
     def get_parents_all(
@@ -771,27 +969,49 @@ class Batch:
         # Iterate over the trajectories to obtain all parents
         self.parents_all = []
         self.parents_actions_all = []
-        self.parents_all_indices = []
+        n_parents = []
         self.parents_all_policy = []
+        # Positions in self.parents_all of the parents that are the previous state in
+        # the trajectory, and batch indices of such states, whose policy format can be
+        # reused from the states in policy format
+        parents_indices = self._get_rows()["parent"].tolist()
+        positions_in_batch = []
+        batch_indices_of_parents = []
         for idx, traj_idx in enumerate(self.traj_indices):
             state = self.states[idx]
             done = self.done[idx]
             action = self.actions[idx]
-            parents, parents_a = self.envs[traj_idx].get_parents(
+            env = self.envs[traj_idx]
+            parents, parents_a = env.get_parents(
                 state=state,
                 done=done,
                 action=action,
             )
+            action_representative = self.env.action2representative(action)
             assert (
-                self.env.action2representative(action) in parents_a
+                action_representative in parents_a
             ), f"""
             Sampled action is not in the list of valid actions from parents.
             \nState:\n{state}\nAction:\n{action}
             """
+            idx_parent = parents_indices[idx]
+            if not self.conditional and idx_parent != -1:
+                for pos, (parent, parent_a) in enumerate(zip(parents, parents_a)):
+                    if parent_a == action_representative and env.equal(
+                        parent, self.states[idx_parent]
+                    ):
+                        positions_in_batch.append(len(self.parents_all) + pos)
+                        batch_indices_of_parents.append(idx_parent)
+                        break
             self.parents_all.extend(parents)
             self.parents_actions_all.extend(parents_a)
-            self.parents_all_indices.extend([idx] * len(parents))
-            self.parents_all_policy.append(self.envs[traj_idx].states2policy(parents))
+            n_parents.append(len(parents))
+            # If the environments are conditional, the parents must be converted by
+            # their own environment
+            if self.conditional:
+                self.parents_all_policy.append(
+                    self.envs[traj_idx].states2policy(parents)
+                )
         # Convert to tensors
         self.parents_actions_all = tfloat(
             self.parents_actions_all,
@@ -799,10 +1019,37 @@ class Batch:
             float_type=self.float,
         )
         self.parents_all_indices = tlong(
-            self.parents_all_indices,
+            np.repeat(np.arange(len(self)), n_parents),
             device=self.device,
         )
-        self.parents_all_policy = torch.cat(self.parents_all_policy)
+        if self.conditional:
+            self.parents_all_policy = torch.cat(self.parents_all_policy)
+        else:
+            # Otherwise, the parents that are states in the batch are gathered from the
+            # states in policy format and the rest are converted with a single call
+            states_policy = self.get_states(policy=True)
+            is_novel = np.ones(len(self.parents_all), dtype=bool)
+            is_novel[positions_in_batch] = False
+            positions_novel = np.flatnonzero(is_novel)
+            self.parents_all_policy = torch.empty(
+                (len(self.parents_all), states_policy.shape[1]),
+                device=self.device,
+                dtype=self.float,
+            )
+            if len(positions_in_batch) > 0:
+                self.parents_all_policy[
+                    tlong(positions_in_batch, device=self.device)
+                ] = states_policy[tlong(batch_indices_of_parents, device=self.device)]
+            if len(positions_novel) > 0:
+                self.parents_all_policy[
+                    tlong(positions_novel, device=self.device)
+                ] = tfloat(
+                    self.env.states2policy(
+                        [self.parents_all[pos] for pos in positions_novel]
+                    ),
+                    device=self.device,
+                    float_type=self.float,
+                )
         self._parents_all_available = True
 
     # TODO: opportunity to improve efficiency by caching.
@@ -833,34 +1080,17 @@ class Batch:
         """
         if self._masks_forward_available is False or force_recompute is True:
             self._compute_masks_forward()
-        # Make tensor
-        masks_invalid_actions_forward = tbool(
-            self.masks_invalid_actions_forward, device=self.device
-        )
+        masks_invalid_actions_forward = self._masks_forward_tensor
         if of_parents:
-            trajectories_parents = {
-                traj_idx: [-1] + batch_indices[:-1]
-                for traj_idx, batch_indices in self.trajectories.items()
-            }
-            parents_indices = tlong(
-                [
-                    trajectories_parents[traj_idx][
-                        self.trajectories[traj_idx].index(idx)
-                    ]
-                    for idx, traj_idx in enumerate(self.traj_indices)
-                ],
-                device=self.device,
-            )
-            masks_invalid_actions_forward_parents = torch.zeros_like(
-                masks_invalid_actions_forward
-            )
-            masks_invalid_actions_forward_parents[parents_indices == -1] = self.source[
-                "mask_forward"
-            ]
-            masks_invalid_actions_forward_parents[parents_indices != -1] = (
-                masks_invalid_actions_forward[parents_indices[parents_indices != -1]]
+            parents_indices = tlong(self._get_rows()["parent"], device=self.device)
+            # Gather the masks of the parents with a single indexing operation and
+            # overwrite the rows whose parent is the source with its mask
+            parent_is_source = parents_indices == -1
+            return torch.where(
+                parent_is_source.unsqueeze(-1),
+                self.source["mask_forward"],
+                masks_invalid_actions_forward[parents_indices.clamp(min=0)],
             )
-            return masks_invalid_actions_forward_parents
         return masks_invalid_actions_forward
 
     def _compute_masks_forward(self):
@@ -879,6 +1109,10 @@ class Batch:
             self.masks_invalid_actions_forward[idx] = self.envs[
                 traj_idx
             ].get_mask_invalid_actions_forward(state, done)
+        # The list of masks is converted into a tensor only once
+        self._masks_forward_tensor = tbool(
+            self.masks_invalid_actions_forward, device=self.device
+        )
         self._masks_forward_available = True
 
     # TODO: opportunity to improve efficiency by caching. Note that
@@ -905,7 +1139,7 @@ class Batch:
         """
         if self._masks_backward_available is False or force_recompute is True:
             self._compute_masks_backward()
-        return tbool(self.masks_invalid_actions_backward, device=self.device)
+        return self._masks_backward_tensor
 
     def _compute_masks_backward(self):
         """
@@ -923,6 +1157,10 @@ class Batch:
             self.masks_invalid_actions_backward[idx] = self.envs[
                 traj_idx
             ].get_mask_invalid_actions_backward(state, done)
+        # The list of masks is converted into a tensor only once
+        self._masks_backward_tensor = tbool(
+            self.masks_invalid_actions_backward, device=self.device
+        )
         self._masks_backward_available = True
 
     # TODO: better handling of availability of rewards, logrewards, proxy_values.
@@ -946,7 +1184,7 @@ class Batch:
             False, non-terminating states will be assigned reward 0.
         """
         if self.rewards_available(log) is False or force_recompute is True:
-            self._compute_rewards(log, do_non_terminating)
+            self._compute_rewards(log, do_non_terminating, force_recompute)
         if log:
             return self.logrewards
         else:
@@ -969,16 +1207,26 @@ class Batch:
             False, non-terminating states will be assigned value inf.
         """
         if self._proxy_values_available is False or force_recompute is True:
-            self._compute_rewards(do_non_terminating=do_non_terminating)
+            self._compute_rewards(
+                do_non_terminating=do_non_terminating, force_recompute=force_recompute
+            )
         return self.proxy_values
 
     def _compute_rewards(
-        self, log: bool = False, do_non_terminating: Optional[bool] = False
+        self,
+        log: bool = False,
+        do_non_terminating: Optional[bool] = False,
+        force_recompute: Optional[bool] = False,
     ):
         """
         Computes rewards for all self.states by first converting the states into proxy
         format. The result is stored in self.rewards as a torch.tensor
 
+        If the proxy values of the terminating states are already available, for
+        example because the rewards have been computed and now the log-rewards are
+        requested, the rewards are obtained from them without calling the proxy
+        again, unless force_recompute is True.
+
         Parameters
         ----------
         log : bool
@@ -986,26 +1234,80 @@ class Batch:
         do_non_terminating : bool
             If True, compute the rewards of the non-terminating states instead of
             assigning reward 0 and proxy value inf.
+        force_recompute : bool
+            If True, the proxy values are recomputed even if they are available.
         """
 
         if do_non_terminating:
             rewards, proxy_values = self.proxy.rewards(
                 self.states2proxy(), log, return_proxy=True
             )
+            self._set_rewards(rewards, proxy_values, log, do_non_terminating=True)
+            return
+        done_indices = self._get_done_indices()
+        if (
+            self._proxy_values_available
+            and not self._proxy_values_non_terminating
+            and not force_recompute
+            and len(self.proxy_values) == len(self)
+        ):
+            proxy_values = self.proxy_values
         else:
-            rewards = self.proxy.get_min_reward(log) * torch.ones(
-                len(self), dtype=self.float, device=self.device
-            )
-            proxy_values = torch.full_like(rewards, torch.inf)
-            done = self.get_done()
-            if len(done) > 0:
-                states_proxy_done = self.get_terminating_states(proxy=True)
-                rewards[done], proxy_values[done] = self.proxy.rewards(
-                    states_proxy_done, log, return_proxy=True
-                )
+            if len(done_indices) > 0:
+                proxy_values_done = self.proxy(self.get_terminating_states(proxy=True))
+            else:
+                proxy_values_done = None
+            proxy_values = self._scatter_done(proxy_values_done, torch.inf)
+        # Only the proxy values of the terminating states are transformed, selected
+        # with the cached indices of the done states rather than with a boolean mask
+        rewards = self.proxy.reward_batch_torch(proxy_values, done_indices, log)
+        self._set_rewards(rewards, proxy_values, log, do_non_terminating=False)
+
+    def _scatter_done(
+        self,
+        values_done: Optional[TensorType["n_done"]],
+        fill_value: float,
+    ) -> TensorType["n_states"]:
+        """
+        Returns a tensor with one value per state in the batch, given the values of the
+        terminating states, sorted by order of insertion. The non-terminating states
+        are assigned fill_value.
+
+        Args
+        ----
+        values_done : tensor
+            The values of the terminating states. If None, the batch must not contain
+            terminating states.
+
+        fill_value : float
+            The value assigned to the non-terminating states, for example inf for the
+            proxy values.
+
+        Returns
+        -------
+        A tensor with the values of all states.
+        """
+        values = torch.full(
+            (len(self),), fill_value, dtype=self.float, device=self.device
+        )
+        if values_done is not None:
+            values[self._get_done_indices()] = values_done
+        return values
 
+    def _set_rewards(
+        self,
+        rewards: TensorType["n_states"],
+        proxy_values: TensorType["n_states"],
+        log: bool,
+        do_non_terminating: bool,
+    ):
+        """
+        Stores the (log)rewards and proxy values of all states in the batch and sets
+        the corresponding availability flags.
+        """
         self.proxy_values = proxy_values
         self._proxy_values_available = True
+        self._proxy_values_non_terminating = do_non_terminating
         if log:
             self.logrewards = rewards
             self._logrewards_available = True
@@ -1013,6 +1315,52 @@ class Batch:
             self.rewards = rewards
             self._rewards_available = True
 
+    @staticmethod
+    def compute_rewards_joint(batches: List["Batch"], log: bool = False):
+        """
+        Computes the (log)rewards of the terminating states of several batches with a
+        single call to the proxy, instead of one call per batch, and stores them in
+        each batch, as get_rewards(do_non_terminating=False) would do.
+
+        All the batches must share the same proxy.
+
+        Args
+        ----
+        batches : list
+            The batches whose rewards are to be computed.
+
+        log : bool
+            If True, compute the logarithm of the rewards.
+        """
+        if len(batches) == 0:
+            return
+        proxy = batches[0].proxy
+        assert all(
+            batch.proxy is proxy for batch in batches
+        ), "All the batches must share the same proxy"
+        # Gather the terminating states of all batches and call the proxy once
+        has_done = [len(batch._get_done_indices()) > 0 for batch in batches]
+        states_proxy_done = [
+            batch.get_terminating_states(proxy=True)
+            for batch, batch_has_done in zip(batches, has_done)
+            if batch_has_done
+        ]
+        if len(states_proxy_done) > 0:
+            proxy_values_done = iter(
+                torch.split(
+                    proxy(_concat(states_proxy_done)),
+                    [len(states) for states in states_proxy_done],
+                )
+            )
+        # Store the proxy values in each batch and compute the rewards from them
+        for batch, batch_has_done in zip(batches, has_done):
+            batch.proxy_values = batch._scatter_done(
+                next(proxy_values_done) if batch_has_done else None, torch.inf
+            )
+            batch._proxy_values_available = True
+            batch._proxy_values_non_terminating = False
+            batch._compute_rewards(log, do_non_terminating=False)
+
     def get_rewards_parents(self, log: bool = False) -> TensorType["n_states"]:
         """
         Returns the rewards of all parents in the batch.
@@ -1140,32 +1488,21 @@ class Batch:
         proxy : bool
             If True, the proxy format of the states is returned.
         """
-        if sort_by == "insert" or sort_by == "insertion":
-            indices = np.arange(len(self))
-        elif sort_by == "traj" or sort_by == "trajectory":
-            indices = np.argsort(self.traj_indices)
-        else:
-            raise ValueError("sort_by must be either insert[ion] or traj[ectory]")
+        indices = self._get_terminating_indices(sort_by)
         if policy is True and proxy is True:
             raise ValueError(
                 "Ambiguous request! Only one of policy or proxy can be True."
             )
         traj_indices = None
         if torch.is_tensor(self.states):
-            indices = tlong(indices, device=self.device)
-            done = self.get_done()[indices]
-            states_term = self.states[indices][done, :]
+            states_term = self.states.index_select(0, indices)
             if self.conditional and (policy is True or proxy is True):
-                traj_indices = tlong(self.traj_indices, device=self.device)[indices][
-                    done
-                ]
-                assert len(traj_indices) == len(torch.unique(traj_indices))
+                traj_indices = self.get_trajectory_indices()[indices]
         elif isinstance(self.states, list):
-            states_term = [self.states[idx] for idx in indices if self.done[idx]]
+            indices = indices.tolist()
+            states_term = [self.states[idx] for idx in indices]
             if self.conditional and (policy is True or proxy is True):
-                done = np.array(self.done, dtype=bool)[indices]
-                traj_indices = np.array(self.traj_indices)[indices][done]
-                assert len(traj_indices) == len(np.unique(traj_indices))
+                traj_indices = [self.traj_indices[idx] for idx in indices]
         else:
             raise NotImplementedError("self.states can only be list or torch.tensor")
         if policy is True:
@@ -1200,19 +1537,15 @@ class Batch:
         force_recompute : bool
             If True, the rewards are recomputed even if they are available.
         """
-        if sort_by == "insert" or sort_by == "insertion":
-            indices = np.arange(len(self))
-        elif sort_by == "traj" or sort_by == "trajectory":
-            indices = np.argsort(self.traj_indices)
-        else:
-            raise ValueError("sort_by must be either insert[ion] or traj[ectory]")
+        indices = self._get_terminating_indices(sort_by)
         if self.rewards_available(log) is False or force_recompute is True:
-            self._compute_rewards(log, do_non_terminating=False)
-        done = self.get_done()[indices]
+            self._compute_rewards(
+                log, do_non_terminating=False, force_recompute=force_recompute
+            )
         if log:
-            return self.logrewards[indices][done]
+            return self.logrewards[indices]
         else:
-            return self.rewards[indices][done]
+            return self.rewards[indices]
 
     def get_terminating_proxy_values(
         self,
@@ -1236,21 +1569,53 @@ class Batch:
         force_recompute : bool
             If True, the proxy_values are recomputed even if they are available.
         """
+        indices = self._get_terminating_indices(sort_by)
+        if self._proxy_values_available is False or force_recompute is True:
+            self._compute_rewards(
+                do_non_terminating=False, force_recompute=force_recompute
+            )
+        return self.proxy_values[indices]
+
+    def _get_terminating_indices(self, sort_by: str) -> TensorType["n_done", int]:
+        """
+        Returns the indices in the batch of the terminating states, that is all states
+        with done = True, as a long int tensor, sorted by order of insertion (sort_by =
+        "insert[ion]") or by trajectory index (sort_by = "traj[ectory]").
+
+        See: get_terminating_states()
+        See: get_terminating_rewards()
+        See: get_terminating_proxy_values()
+
+        Args
+        ----
+        sort_by : str
+            Indicates how to sort the indices: insert[ion] or traj[ectory].
+
+        Returns
+        -------
+        A long int tensor with the indices of the terminating states.
+        """
         if sort_by == "insert" or sort_by == "insertion":
-            indices = np.arange(len(self))
+            return self._get_done_indices()
         elif sort_by == "traj" or sort_by == "trajectory":
-            indices = np.argsort(self.traj_indices)
+            if self._terminating_indices_by_traj is None:
+                # There is one terminating state per trajectory at most, so it suffices
+                # to sort the terminating states by their trajectory index
+                done_indices = self._get_done_indices()
+                traj_indices = np.array(
+                    [self.traj_indices[idx] for idx in done_indices.tolist()]
+                )
+                self._terminating_indices_by_traj = done_indices[
+                    tlong(np.argsort(traj_indices), device=self.device)
+                ]
+            return self._terminating_indices_by_traj
         else:
             raise ValueError("sort_by must be either insert[ion] or traj[ectory]")
-        if self._proxy_values_available is False or force_recompute is True:
-            self._compute_rewards(log, do_non_terminating=False)
-        done = self.get_done()[indices]
-        return self.proxy_values[indices][done]
 
     def get_actions_trajectories(self) -> List[List[Tuple]]:
         """
         Returns the actions corresponding to all trajectories in the batch, sorted by
-        trajectory index (the order in the ordered dict self.trajectories).
+        trajectory index (the insertion order of self.trajectories).
         """
         actions_trajectories = []
         for batch_indices in self.trajectories.values():
@@ -1290,16 +1655,28 @@ class Batch:
         -------
         Tensor, array or list of states of the requested trajectory.
         """
-        # TODO: re-implement using the batch indices in self.trajectories[traj_idx]
+        # If states and traj_indices are None, or are the states and trajectory
+        # indices of the batch, the states are gathered directly at the batch indices
+        # of the trajectory, in batch order.
+        if (states is None and traj_indices is None) or (
+            states is self.states and traj_indices is self.traj_indices
+        ):
+            batch_indices = sorted(self.trajectories.get(traj_idx, []))
+            if torch.is_tensor(self.states):
+                return self.states.index_select(
+                    0,
+                    torch.as_tensor(
+                        batch_indices, dtype=torch.long, device=self.device
+                    ),
+                )
+            elif isinstance(self.states, np.ndarray):
+                return self.states[batch_indices]
+            return [self.states[idx] for idx in batch_indices]
         # If either states or traj_indices are not None, both must be the same type and
         # have the same length.
         # TODO: or add sort_by
-        if states is not None or traj_indices is not None:
-            assert type(states) == type(traj_indices)
-            assert len(states) == len(traj_indices)
-        else:
-            states = self.states
-            traj_indices = self.traj_indices
+        assert type(states) == type(traj_indices)
+        assert len(states) == len(traj_indices)
         if torch.is_tensor(states):
             return states[tlong(traj_indices, device=self.device) == traj_idx]
         elif isinstance(states, list):
@@ -1322,57 +1699,63 @@ class Batch:
         """
         if not isinstance(batches, list):
             batches = [batches]
+        batches = [batch for batch in batches if len(batch) > 0]
+        # Shift the trajectory and batch indices of the batches to merge, so that they
+        # follow the indices of the previous batches
+        max_traj_idx = max(self.trajectories) if len(self) > 0 else -1
+        batch_shift = len(self)
         for batch in batches:
-            if len(batch) == 0:
-                continue
-            # Shift trajectory indices of batch to merge
-            if len(self) == 0:
-                traj_idx_shift = 0
-            else:
-                traj_idx_shift = np.max(list(self.trajectories.keys())) + 1
-            batch._shift_indices(traj_shift=traj_idx_shift, batch_shift=len(self))
-            # Merge main data
-            self.size += batch.size
+            batch._shift_indices(traj_shift=max_traj_idx + 1, batch_shift=batch_shift)
+            max_traj_idx = max(batch.trajectories)
+            batch_shift += len(batch)
             self.envs.update(batch.envs)
             self.trajectories.update(batch.trajectories)
-            self.traj_indices.extend(batch.traj_indices)
-            self.state_indices.extend(batch.state_indices)
-            self.states.extend(batch.states)
-            self.actions.extend(batch.actions)
-            self.done.extend(batch.done)
-            self.masks_invalid_actions_forward = extend(
-                self.masks_invalid_actions_forward,
-                batch.masks_invalid_actions_forward,
-            )
-            self.masks_invalid_actions_backward = extend(
-                self.masks_invalid_actions_backward,
-                batch.masks_invalid_actions_backward,
-            )
-            # Merge "optional" data
-            if self.states_policy is not None and batch.states_policy is not None:
-                self.states_policy = extend(self.states_policy, batch.states_policy)
-            else:
-                self.states_policy = None
-            if self._parents_available and batch._parents_available:
-                self.parents = extend(self.parents, batch.parents)
-            else:
-                self.parents = None
-            if self._parents_policy_available and batch._parents_policy_available:
-                self.parents_policy = extend(self.parents_policy, batch.parents_policy)
-            else:
-                self.parents_policy = None
-            if self._parents_all_available and batch._parents_all_available:
-                self.parents_all = extend(self.parents_all, batch.parents_all)
-            else:
-                self.parents_all = None
-            if self._rewards_available and batch._rewards_available:
-                self.rewards = extend(self.rewards, batch.rewards)
-            else:
-                self.rewards = None
-            if self._logrewards_available and batch._logrewards_available:
-                self.logrewards = extend(self.logrewards, batch.logrewards)
-            else:
-                self.logrewards = None
+        if len(batches) > 0:
+            # Merge main data, extending each attribute once with all the batches
+            self.size = batch_shift
+            for attr in (
+                "traj_indices",
+                "state_indices",
+                "states",
+                "actions",
+                "done",
+                "masks_invalid_actions_forward",
+                "masks_invalid_actions_backward",
+            ):
+                getattr(self, attr).extend(
+                    itertools.chain.from_iterable(
+                        getattr(batch, attr) for batch in batches
+                    )
+                )
+            self._reset_cached_tensors()
+            # The mask tensors are recomputed from the lists when needed
+            self._masks_forward_available = False
+            self._masks_backward_available = False
+            # The proxy values are not merged and are recomputed when needed
+            self._proxy_values_available = False
+            # Merge "optional" data, which is kept only if it is available in the
+            # current batch and in all the batches to merge, with a single
+            # concatenation per attribute
+            optional_data = {
+                "states_policy": lambda batch: batch.states_policy is not None,
+                "parents": lambda batch: batch._parents_available,
+                "parents_policy": lambda batch: batch._parents_policy_available,
+                "parents_all": lambda batch: batch._parents_all_available,
+                "rewards": lambda batch: batch._rewards_available,
+                "logrewards": lambda batch: batch._logrewards_available,
+            }
+            for attr, is_available in optional_data.items():
+                if is_available(self) and all(is_available(b) for b in batches):
+                    setattr(
+                        self,
+                        attr,
+                        _concat(
+                            [getattr(self, attr)]
+                            + [getattr(batch, attr) for batch in batches]
+                        ),
+                    )
+                else:
+                    setattr(self, attr, None)
         assert self.is_valid()
         return self
 
@@ -1380,6 +1763,20 @@ class Batch:
         """
         Performs basic checks on the current state of the batch.
 
+        The result is cached until the batch is modified (see _reset_cached_tensors()).
+
+        Returns
+        -------
+        True if all the checks are valid, False otherwise.
+        """
+        if self._is_valid is None:
+            self._is_valid = self._check_validity()
+        return self._is_valid
+
+    def _check_validity(self) -> bool:
+        """
+        Performs the checks of is_valid() without using the cached result.
+
         Returns
         -------
         True if all the checks are valid, False otherwise.
@@ -1394,18 +1791,24 @@ class Batch:
             return False
         if len(self.state_indices) != len(self):
             return False
-        if set(np.unique(self.traj_indices)) != set(self.envs.keys()):
+        if set(self.traj_indices) != self.envs.keys():
             return False
-        if set(self.trajectories.keys()) != set(self.envs.keys()):
+        if self.trajectories.keys() != self.envs.keys():
             return False
-        batch_indices = [
-            idx for indices in self.trajectories.values() for idx in indices
-        ]
+        batch_indices = np.fromiter(
+            itertools.chain.from_iterable(self.trajectories.values()), dtype=np.int64
+        )
         if len(batch_indices) != len(self):
             return False
-        if len(np.unique(batch_indices)) != len(batch_indices):
+        # The batch indices must be a permutation of range(len(self)), which is checked
+        # in linear time by marking the indices present, instead of sorting them
+        if len(self) == 0:
+            return True
+        if batch_indices.min() < 0 or batch_indices.max() >= len(self):
             return False
-        return True
+        is_present = np.zeros(len(self), dtype=bool)
+        is_present[batch_indices] = True
+        return bool(is_present.all())
 
     def traj_indices_are_consecutive(self) -> bool:
         """
@@ -1438,12 +1841,11 @@ class Batch:
         if self.traj_indices_are_consecutive():
             return
         self.traj_indices = self.get_trajectory_indices(consecutive=True).tolist()
-        self.trajectories = OrderedDict(
+        self._reset_cached_tensors()
+        self.trajectories = dict(
             zip(range(self.get_n_trajectories()), self.trajectories.values())
         )
-        self.envs = OrderedDict(
-            {idx: env.set_id(idx) for idx, env in enumerate(self.envs.values())}
-        )
+        self.envs = {idx: env.set_id(idx) for idx, env in enumerate(self.envs.values())}
         assert self.traj_indices_are_consecutive()
         assert self.is_valid()
 
@@ -1456,18 +1858,24 @@ class Batch:
         -------
         self
         """
-        if not self.is_valid():
-            raise Exception("Batch is not valid before attempting indices shift")
+        # Shifting all the indices by a constant preserves the validity of the batch,
+        # so it only needs to be checked before the shift. Like the other consistency
+        # checks of the batch, it is skipped if Python runs with optimizations (-O).
+        assert self.is_valid(), "Batch is not valid before attempting indices shift"
+        # Nothing changes, for example when the first batch is merged into an empty one
+        if traj_shift == 0 and batch_shift == 0:
+            return self
+        is_valid = self._is_valid
         self.traj_indices = [idx + traj_shift for idx in self.traj_indices]
+        self._reset_cached_tensors()
+        self._is_valid = is_valid
         self.trajectories = {
-            traj_idx + traj_shift: list(map(lambda x: x + batch_shift, batch_indices))
+            traj_idx + traj_shift: [idx + batch_shift for idx in batch_indices]
             for traj_idx, batch_indices in self.trajectories.items()
         }
         self.envs = {
             k + traj_shift: env.set_id(k + traj_shift) for k, env in self.envs.items()
         }
-        if not self.is_valid():
-            raise Exception("Batch is not valid after performing indices shift")
         return self
 
     # TODO: rewrite once cache is implemnted
@@ -2,6 +2,7 @@
 Buffer class to handle train and test data sets, reply buffer, etc.
 """
 
+import heapq
 import pickle
 from pathlib import Path
 from typing import List
@@ -36,13 +37,24 @@ class Buffer:
         self.env = env
         self.proxy = proxy
         self.replay_capacity = replay_capacity
-        self.main = pd.DataFrame(columns=["state", "traj", "reward", "iter"])
-        self.replay = pd.DataFrame(
-            np.empty((self.replay_capacity, 4), dtype=object),
-            columns=["state", "traj", "reward", "iter"],
-        )
-        self.replay.reward = pd.to_numeric(self.replay.reward)
-        self.replay.reward = [-1 for _ in range(self.replay_capacity)]
+        # New rows of the main buffer are accumulated in lists and only concatenated
+        # to the DataFrame when it is accessed (see the main property), in order to
+        # avoid copying the whole DataFrame at every iteration.
+        self._main = pd.DataFrame(columns=["state", "traj", "reward", "iter"])
+        self._main_pending = {"state": [], "traj": [], "reward": [], "iter": []}
+        # The replay buffer is stored as a dictionary of NumPy arrays (one column per
+        # field and one slot per element of the buffer) together with a min-heap of
+        # (reward, slot) tuples, such that the slot with the minimum reward can be
+        # retrieved and replaced in O(log N). The DataFrame is only materialized on
+        # demand (see the replay property).
+        self._replay = {
+            "state": np.full(self.replay_capacity, None, dtype=object),
+            "traj": np.full(self.replay_capacity, None, dtype=object),
+            "reward": np.full(self.replay_capacity, -1.0),
+            "iter": np.full(self.replay_capacity, None, dtype=object),
+        }
+        self._replay_heap = [(-1.0, slot) for slot in range(self.replay_capacity)]
+        heapq.heapify(self._replay_heap)
         self.replay_states = {}
         self.replay_trajs = {}
         self.replay_rewards = {}
@@ -115,6 +127,37 @@ class Buffer:
                 self.test
             )
 
+    @property
+    def main(self) -> pd.DataFrame:
+        """
+        Returns the main buffer as a DataFrame with columns state, traj, reward and
+        iter, after concatenating the rows added since the last access.
+        """
+        if len(self._main_pending["state"]) > 0:
+            self._main = pd.concat(
+                [self._main, pd.DataFrame(self._main_pending)],
+                axis=0,
+                join="outer",
+            )
+            self._main_pending = {"state": [], "traj": [], "reward": [], "iter": []}
+        return self._main
+
+    @property
+    def replay(self) -> pd.DataFrame:
+        """
+        Returns the replay buffer as a DataFrame with columns state, traj, reward and
+        iter, sorted by reward in descending order. Empty slots have reward -1.
+        """
+        order = np.argsort(-self._replay["reward"], kind="stable")
+        # The dtype of each column is set explicitly, so that the state, traj and iter
+        # columns are kept as object columns with None in the empty slots
+        return pd.DataFrame(
+            {
+                column: pd.Series(values[order], index=order, dtype=values.dtype)
+                for column, values in self._replay.items()
+            }
+        )
+
     def save_replay(self):
         with open(self.replay_pkl, "wb") as f:
             pickle.dump(
@@ -132,6 +175,10 @@ class Buffer:
 
         Note that the rewards may be log-rewards.
 
+        The readable representations of the states and trajectories are computed
+        here. If the same batch is to be added to several buffers, it is preferable to
+        compute them once and call add_preformatted instead.
+
         Parameters
         ----------
         states : list
@@ -147,26 +194,66 @@ class Buffer:
         criterion : str
             Identifier of the criterion. Currently, only greater is implemented.
         """
+        self.add_preformatted(
+            states,
+            trajs,
+            [self.env.state2readable(s) for s in states],
+            [self.env.traj2readable(p) for p in trajs],
+            rewards,
+            it,
+            buffer,
+            criterion,
+        )
+
+    def add_preformatted(
+        self,
+        states,
+        trajs,
+        states_readable,
+        trajs_readable,
+        rewards,
+        it,
+        buffer="main",
+        criterion="greater",
+    ):
+        """
+        Adds a batch of states (with the trajectory actions and rewards) to the buffer,
+        given the readable representations of the states and trajectories.
+
+        Note that the rewards may be log-rewards.
+
+        Parameters
+        ----------
+        states : list
+            A batch of terminating states.
+        trajs : list
+            The list of trajectory actions of each terminating state.
+        states_readable : list
+            The readable representation of each state, as returned by
+            env.state2readable().
+        trajs_readable : list
+            The readable representation of each trajectory, as returned by
+            env.traj2readable().
+        rewards : list
+            The reward or log-reward of each terminating state.
+        it : int
+            Iteration number.
+        buffer : str
+            Identifier of the buffer: main or replay
+        criterion : str
+            Identifier of the criterion. Currently, only greater is implemented.
+        """
         if buffer == "main":
-            self.main = pd.concat(
-                [
-                    self.main,
-                    pd.DataFrame(
-                        {
-                            "state": [self.env.state2readable(s) for s in states],
-                            "traj": [self.env.traj2readable(p) for p in trajs],
-                            "reward": rewards,
-                            "iter": it,
-                        }
-                    ),
-                ],
-                axis=0,
-                join="outer",
-            )
+            self._main_pending["state"].extend(states_readable)
+            self._main_pending["traj"].extend(trajs_readable)
+            self._main_pending["reward"].extend(rewards)
+            self._main_pending["iter"].extend([it] * len(states))
         elif buffer == "replay":
             if self.replay_capacity > 0:
                 if criterion == "greater":
-                    self.replay = self._add_greater(states, trajs, rewards, it)
+                    self._add_greater(
+                        states, trajs, states_readable, trajs_readable, rewards, it
+                    )
                 else:
                     raise ValueError(
                         f"Unknown criterion identifier. Received {buffer}, "
@@ -177,7 +264,16 @@ class Buffer:
                 f"Unknown buffer identifier. Received {buffer}, expected main or replay"
             )
 
-    def _add_greater(self, states, trajs, rewards, it, allow_duplicate_states=False):
+    def _add_greater(
+        self,
+        states,
+        trajs,
+        states_readable,
+        trajs_readable,
+        rewards,
+        it,
+        allow_duplicate_states=False,
+    ):
         """
         Adds a batch of states (with the trajectory actions and rewards) to the buffer
         if the state reward is larger than the minimum reward in the buffer and the
@@ -193,6 +289,10 @@ class Buffer:
             A batch of terminating states.
         trajs : list
             The list of trajectory actions of each terminating state.
+        states_readable : list
+            The readable representation of each state.
+        trajs_readable : list
+            The readable representation of each trajectory.
         rewards : list
             The reward or log-reward of each terminating state.
         it : int
@@ -201,7 +301,18 @@ class Buffer:
             If True, terminating states already present in the buffer will be added
             provided the trajectory is different and the reward criterion is satisfied.
         """
-        for idx, (state, traj, reward) in enumerate(zip(states, trajs, rewards)):
+        rewards = np.asarray(rewards, dtype=float)
+        # Only the rewards larger than the current minimum in the buffer can be
+        # added, so the rest are discarded with a single vectorized comparison.
+        candidates = np.flatnonzero(rewards > self._replay_heap[0][0])
+        # Candidates are visited in descending order of reward, so that the loop can
+        # stop as soon as a reward is not larger than the minimum in the buffer.
+        candidates = candidates[np.argsort(-rewards[candidates], kind="stable")]
+        for idx in candidates.tolist():
+            state, traj, reward = states[idx], trajs[idx], float(rewards[idx])
+            reward_min, slot = self._replay_heap[0]
+            if reward <= reward_min:
+                break
             if not allow_duplicate_states:
                 if isinstance(state, torch.Tensor):
                     is_duplicate = False
@@ -213,22 +324,17 @@ class Buffer:
                     is_duplicate = state in self.replay_states.values()
                 if is_duplicate:
                     continue
-            if (
-                reward > self.replay.iloc[-1]["reward"]
-                and traj not in self.replay_trajs.values()
-            ):
-                self.replay.iloc[-1] = {
-                    "state": self.env.state2readable(state),
-                    "traj": self.env.traj2readable(traj),
-                    "reward": reward,
-                    "iter": it,
-                }
-                self.replay_states[(idx, it)] = state
-                self.replay_trajs[(idx, it)] = traj
-                self.replay_rewards[(idx, it)] = reward
-                self.replay.sort_values(by="reward", ascending=False, inplace=True)
+            if traj in self.replay_trajs.values():
+                continue
+            heapq.heapreplace(self._replay_heap, (reward, slot))
+            self._replay["state"][slot] = states_readable[idx]
+            self._replay["traj"][slot] = trajs_readable[idx]
+            self._replay["reward"][slot] = reward
+            self._replay["iter"][slot] = it
+            self.replay_states[(idx, it)] = state
+            self.replay_trajs[(idx, it)] = traj
+            self.replay_rewards[(idx, it)] = reward
         self.save_replay()
-        return self.replay
 
     def make_data_set(self, config):
         """
@@ -306,12 +412,15 @@ class Buffer:
 
     @staticmethod
     def compute_stats(data):
-        mean_data = data["energies"].mean()
-        std_data = data["energies"].std()
-        min_data = data["energies"].min()
-        max_data = data["energies"].max()
-        data_zscores = (data["energies"] - mean_data) / std_data
-        max_norm_data = data_zscores.max()
+        energies = data["energies"].to_numpy(dtype=float)
+        # NaN energies are skipped, as in the pandas reductions
+        mean_data = np.nanmean(energies)
+        std_data = np.nanstd(energies, ddof=1)
+        min_data = np.nanmin(energies)
+        max_data = np.nanmax(energies)
+        # The z-score is monotonic in the energy, so the maximum z-score is the
+        # z-score of the maximum energy.
+        max_norm_data = (max_data - mean_data) / std_data
         return mean_data, std_data, min_data, max_data, max_norm_data
 
     @staticmethod
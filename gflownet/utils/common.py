@@ -462,6 +462,14 @@ def tfloat(x, device, float_type):
         return torch.stack(x).to(device=device, dtype=float_type)
     if torch.is_tensor(x):
         return x.to(device=device, dtype=float_type)
+    # Nested sequences (for example a batch of states) are first packed into a
+    # contiguous array, which is much faster to convert than nested Python lists.
+    if (
+        isinstance(x, list)
+        and len(x) > 0
+        and isinstance(x[0], (list, tuple, np.ndarray))
+    ):
+        return torch.from_numpy(np.asarray(x)).to(device=device, dtype=float_type)
     else:
         return torch.tensor(x, dtype=float_type, device=device)
 
@@ -621,11 +629,20 @@ def extend(
     return orig
 
 
+_NUMBER_TYPES = (int, float, bool)
+"""
+Types of the elements of the lists that copy() can copy without deepcopy.
+"""
+
+
 def copy(x: Union[List, TensorType["..."]]):
     """
     Makes copy of the input tensor or list.
 
-    A tensor is cloned and detached from the computational graph.
+    A tensor is cloned and detached from the computational graph. Flat lists of
+    numbers and numerical arrays, the most common types of states, are copied
+    directly, since a shallow copy is then equivalent to a deep copy and much
+    faster. Any other input is deep-copied.
 
     Parameters
     ----------
@@ -639,8 +656,11 @@ def copy(x: Union[List, TensorType["..."]]):
     """
     if torch.is_tensor(x):
         return x.clone().detach()
-    else:
-        return deepcopy(x)
+    if type(x) is list and all(type(el) in _NUMBER_TYPES for el in x):
+        return x.copy()
+    if type(x) is np.ndarray and x.dtype != object:
+        return x.copy()
+    return deepcopy(x)
 
 
 def bootstrap_samples(tensor, num_samples):
@@ -98,6 +98,32 @@ def test__get_action_space__returns_expected(
     assert set(action_space) == set(env_extended_action_space_2d.action_space)
 
 
+@pytest.mark.parametrize("skip_mask_check", [False, True])
+def test__step__from_source_is_valid_with_and_without_mask_check(env, skip_mask_check):
+    action = env.action_space[0]
+    state_next, action_executed, valid = env.step(
+        action, skip_mask_check=skip_mask_check
+    )
+    assert valid
+    assert action_executed == action
+    assert state_next != env.source
+
+
+def test__step_batch__matches_step(env):
+    envs = [env.copy().reset(idx) for idx in range(3)]
+    envs_ref = [env.copy().reset(idx) for idx in range(3)]
+    actions = [env.action_space[0], env.action_space[1], env.eos]
+    states, actions_executed, valids = env.step_batch(envs, actions)
+    for env_ref, env_batch, action, state, action_executed, valid in zip(
+        envs_ref, envs, actions, states, actions_executed, valids
+    ):
+        state_ref, action_ref, valid_ref = env_ref.step(action)
+        assert state == state_ref == env_batch.state
+        assert action_executed == action_ref
+        assert valid == valid_ref
+        assert env_batch.done == env_ref.done
+
+
 class TestGridBasic(common.BaseTestsContinuous):
     """Common tests for 5x5 Grid with standard action space."""
 
@@ -4,32 +4,53 @@ import torch
 
 from gflownet.envs.tetris import Tetris
 
+EMPTY_BOARD_5X4 = [[0] * 4 for _ in range(5)]
 
-@pytest.fixture
+
+def _board(board):
+    """
+    Converts a board given as a list of rows into a tensor with the data type of the
+    Tetris states.
+    """
+    return torch.tensor(board, dtype=torch.int16)
+
+
+@pytest.fixture(scope="module")
 def env():
     return Tetris(width=4, height=5, device="cpu")
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def env6x4():
     return Tetris(width=4, height=6, device="cpu")
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def env_mini():
     return Tetris(width=4, height=5, pieces=["I", "O"], rotations=[0], device="cpu")
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def env_1piece():
     return Tetris(width=4, height=5, pieces=["O"], rotations=[0], device="cpu")
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def env_full():
     return Tetris(width=10, height=20, device="cpu")
 
 
+@pytest.fixture(autouse=True)
+def reset_envs(request):
+    """
+    The environments are shared by all the tests of the module, so the environments
+    used by each test are reset before running it.
+    """
+    for name in ("env", "env6x4", "env_mini", "env_1piece", "env_full"):
+        if name in request.fixturenames:
+            request.getfixturevalue(name).reset()
+
+
 @pytest.mark.parametrize(
     "action_space",
     [
@@ -94,7 +115,7 @@ def test__get_action_space__returns_expected(env, action_space):
     "state, action, state_next_expected, valid_expected",
     [
         (
-            [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]],
+            EMPTY_BOARD_5X4,
             (4, 0, 0),
             [
                 [000, 000, 000, 000],
@@ -142,7 +163,7 @@ def test__get_action_space__returns_expected(env, action_space):
             True,
         ),
         (
-            [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]],
+            EMPTY_BOARD_5X4,
             (1, 0, 3),
             [
                 [000, 000, 000, 000],
@@ -230,8 +251,8 @@ def test__get_action_space__returns_expected(env, action_space):
 def test__drop_piece_on_board__returns_expected(
     env, state, action, state_next_expected, valid_expected
 ):
-    state = torch.tensor(state, dtype=torch.int16)
-    state_next_expected = torch.tensor(state_next_expected, dtype=torch.int16)
+    state = _board(state)
+    state_next_expected = _board(state_next_expected)
     env.set_state(state)
     state_next, valid = env._drop_piece_on_board(action)
     assert torch.equal(state_next, state_next_expected)
@@ -241,7 +262,7 @@ def test__drop_piece_on_board__returns_expected(
     "state, mask_expected",
     [
         (
-            [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]],
+            EMPTY_BOARD_5X4,
             [False, False, False, True],
         ),
         (
@@ -269,7 +290,7 @@ def test__drop_piece_on_board__returns_expected(
 def test__mask_invalid_actions_forward__returns_expected(
     env_1piece, state, mask_expected
 ):
-    state = torch.tensor(state, dtype=torch.int16)
+    state = _board(state)
     mask = env_1piece.get_mask_invalid_actions_forward(state, False)
     assert mask == mask_expected
 
@@ -278,7 +299,7 @@ def test__mask_invalid_actions_forward__returns_expected(
     "state, action, next_state",
     [
         (
-            [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]],
+            EMPTY_BOARD_5X4,
             (4, 0, 0),
             [
                 [000, 000, 000, 000],
@@ -308,9 +329,9 @@ def test__mask_invalid_actions_forward__returns_expected(
     ],
 )
 def test__step__returns_expected(env, state, action, next_state):
-    env.set_state(torch.tensor(state, dtype=torch.int16))
+    env.set_state(_board(state))
     env.step(action)
-    assert torch.equal(env.state, torch.tensor(next_state, dtype=torch.int16))
+    assert torch.equal(env.state, _board(next_state))
 
 
 @pytest.mark.parametrize(
@@ -385,7 +406,7 @@ def test__step__returns_expected(env, state, action, next_state):
     ],
 )
 def test__piece_can_be_lifted__returns_expected(env, board, piece_idx, expected):
-    board = torch.tensor(board, dtype=torch.int16)
+    board = _board(board)
     assert env._piece_can_be_lifted(board, piece_idx) == expected
 
 
@@ -455,10 +476,8 @@ def test__piece_can_be_lifted__returns_expected(env, board, piece_idx, expected)
 def test__get_parents__returns_expected(
     env6x4, state, parents_expected, parents_a_expected
 ):
-    state = torch.tensor(state, dtype=torch.int16)
-    parents_expected = [
-        torch.tensor(parent, dtype=torch.int16) for parent in parents_expected
-    ]
+    state = _board(state)
+    parents_expected = [_board(parent) for parent in parents_expected]
     parents, parents_a = env6x4.get_parents(state)
     for p, p_e in zip(parents, parents_expected):
         assert torch.equal(p, p_e)
@@ -508,8 +527,8 @@ def test__get_parents__returns_expected(
 def test__get_parents__contains_expected(
     env, state, parent_expected, parent_a_expected
 ):
-    state = torch.tensor(state, dtype=torch.int16)
-    parent_expected = torch.tensor(parent_expected, dtype=torch.int16)
+    state = _board(state)
+    parent_expected = _board(parent_expected)
     parents, parents_a = env.get_parents(state)
     assert any([torch.equal(p, parent_expected) for p in parents])
     assert any([a == parent_a_expected for a in parents_a])
@@ -1181,3 +1181,36 @@ def test__get_max_rewards__returns_expected(
     proxy.optimum = torch.tensor(optimum)
     assert torch.isclose(proxy.get_max_reward(log=False), reward_max)
     assert torch.isclose(proxy.get_max_reward(log=True), torch.log(reward_max))
+
+
+@pytest.mark.parametrize(
+    "beta, proxy_values, done",
+    [
+        (
+            2,
+            [-1.0, 0.5, 2.0, torch.inf, 3.0],
+            [True, True, True, False, False],
+        ),
+        (
+            0.5,
+            [1.0, torch.inf, torch.inf],
+            [True, False, False],
+        ),
+    ],
+)
+def test__reward_batch_torch__matches_proxy2reward_on_done(
+    proxy_power, beta, proxy_values, done
+):
+    proxy = proxy_power
+    proxy_values = tfloat(proxy_values, device=proxy.device, float_type=proxy.float)
+    done = torch.tensor(done, device=proxy.device)
+    for log in [False, True]:
+        if log:
+            rewards_done = proxy.proxy2logreward(proxy_values[done])
+        else:
+            rewards_done = proxy.proxy2reward(proxy_values[done])
+        # The terminating elements may be given as a boolean mask or as indices
+        for done_selection in [done, torch.nonzero(done).squeeze(-1)]:
+            rewards = proxy.reward_batch_torch(proxy_values, done_selection, log)
+            assert torch.equal(rewards[done], rewards_done)
+            assert torch.all(rewards[~done] == proxy.get_min_reward(log))
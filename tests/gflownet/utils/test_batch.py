@@ -309,6 +309,64 @@ def test__get_logrewards__single_env_returns_expected(env, proxy, batch, request
     ), (logrewards, logrewards_batch)
 
 
+@pytest.mark.repeat(N_REPETITIONS)
+@pytest.mark.parametrize(
+    "env, proxy",
+    [("grid2d", "corners"), ("tetris6x4", "tetris_score"), ("ctorus2d5l", "corners")],
+)
+@pytest.mark.parametrize("log", [False, True])
+def test__compute_rewards_joint__matches_rewards_of_each_batch(
+    env, proxy, log, request
+):
+    env_ref = request.getfixturevalue(env)
+    proxy = request.getfixturevalue(proxy)
+    proxy.setup(env_ref)
+    batches = []
+    for n_envs in [BATCH_SIZE, 1, 0, BATCH_SIZE]:
+        batch = Batch(env=env_ref, proxy=proxy)
+        envs = [env_ref.copy().reset(idx) for idx in range(n_envs)]
+        while envs:
+            actions = [env.step_random()[1] for env in envs]
+            batch.add_to_batch(envs, actions, [True] * len(envs))
+            envs = [env for env in envs if not env.done]
+        batches.append(batch)
+    Batch.compute_rewards_joint(batches, log=log)
+    for batch in batches:
+        assert batch.rewards_available(log)
+        rewards_joint = batch.get_rewards(log=log)
+        rewards = batch.get_rewards(log=log, force_recompute=True)
+        assert torch.allclose(rewards_joint, rewards), (rewards_joint, rewards)
+
+
+@pytest.mark.repeat(N_REPETITIONS)
+@pytest.mark.parametrize(
+    "env, proxy",
+    [("grid2d", "corners"), ("tetris6x4", "tetris_score"), ("ctorus2d5l", "corners")],
+)
+@pytest.mark.parametrize("log", [False, True])
+def test__get_rewards__after_adding_to_batch_matches_recomputed(
+    env, proxy, log, batch, request
+):
+    env_ref = request.getfixturevalue(env)
+    proxy = request.getfixturevalue(proxy)
+    proxy.setup(env_ref)
+    batch.set_env(env_ref)
+    batch.set_proxy(proxy)
+    for traj_indices in [range(BATCH_SIZE), range(BATCH_SIZE, 2 * BATCH_SIZE)]:
+        envs = [env_ref.copy().reset(idx) for idx in traj_indices]
+        while envs:
+            actions = [env.step_random()[1] for env in envs]
+            batch.add_to_batch(envs, actions, [True] * len(envs))
+            envs = [env for env in envs if not env.done]
+        rewards = batch.get_rewards(log=log)
+        assert len(rewards) == len(batch)
+        rewards_recomputed = batch.get_rewards(log=log, force_recompute=True)
+        assert torch.allclose(rewards, rewards_recomputed), (
+            rewards,
+            rewards_recomputed,
+        )
+
+
 @pytest.mark.repeat(N_REPETITIONS)
 @pytest.mark.parametrize(
     "env, proxy",
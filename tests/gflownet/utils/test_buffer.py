@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gflownet.envs.grid import Grid
+from gflownet.proxy.box.corners import Corners
+from gflownet.utils.buffer import Buffer
+
+
+@pytest.fixture
+def grid2d():
+    return Grid(n_dim=2, length=3, cell_min=-1.0, cell_max=1.0)
+
+
+@pytest.fixture
+def corners(grid2d):
+    proxy = Corners(device="cpu", float_precision=32, mu=0.75, sigma=0.05)
+    proxy.setup(grid2d)
+    return proxy
+
+
+@pytest.fixture
+def make_buffer(grid2d, corners, tmp_path, monkeypatch):
+    # Without a logger, the buffer writes its files in ./logs
+    monkeypatch.chdir(tmp_path)
+
+    def _make_buffer(replay_capacity=0):
+        return Buffer(env=grid2d, proxy=corners, replay_capacity=replay_capacity)
+
+    return _make_buffer
+
+
+def _states_and_trajs(states):
+    """
+    Returns the states given as argument together with a distinct trajectory for each
+    of them.
+    """
+    return states, [[tuple(state)] for state in states]
+
+
+@pytest.mark.parametrize(
+    "batches, rewards_expected",
+    [
+        (
+            [
+                ([[0, 0], [0, 1], [0, 2]], [0.5, 0.2, 0.9]),
+                ([[1, 0], [1, 1], [1, 2], [2, 0]], [0.1, 0.7, 0.3, 0.8]),
+            ],
+            [0.9, 0.8, 0.7],
+        ),
+        (
+            [
+                ([[0, 0]], [0.5]),
+                ([[0, 1]], [0.2]),
+                ([[0, 2], [1, 0]], [0.4, 0.6]),
+            ],
+            [0.6, 0.5, 0.4],
+        ),
+        (
+            [([[0, 0], [0, 1]], [0.5, 0.2])],
+            [0.5, 0.2, -1.0],
+        ),
+    ],
+)
+def test__add_replay__keeps_top_k(make_buffer, grid2d, batches, rewards_expected):
+    buffer = make_buffer(replay_capacity=3)
+    readable_expected = {}
+    for it, (states, rewards) in enumerate(batches):
+        states, trajs = _states_and_trajs(states)
+        buffer.add(states, trajs, rewards, it, buffer="replay")
+        for state, reward in zip(states, rewards):
+            readable_expected[reward] = (grid2d.state2readable(state), it)
+    replay = buffer.replay
+    assert replay["reward"].tolist() == rewards_expected
+    for _, row in replay.iterrows():
+        if row["reward"] == -1.0:
+            assert row["state"] is None
+            assert row["traj"] is None
+            assert row["iter"] is None
+        else:
+            assert (row["state"], row["iter"]) == readable_expected[row["reward"]]
+
+
+def test__add_replay__skips_duplicate_trajectories(make_buffer):
+    buffer = make_buffer(replay_capacity=3)
+    states, trajs = _states_and_trajs([[0, 0], [0, 1]])
+    buffer.add(states, trajs, [0.5, 0.2], 0, buffer="replay")
+    # A trajectory already in the buffer is not added again, even with a larger reward
+    buffer.add([[0, 0]], [trajs[0]], [0.9], 1, buffer="replay")
+    # A trajectory already in the buffer is not added again for a different state
+    buffer.add([[2, 2]], [trajs[1]], [0.8], 1, buffer="replay")
+    # A repeated trajectory within a batch is only added once
+    states_new, trajs_new = _states_and_trajs([[1, 1], [1, 1]])
+    buffer.add(states_new, trajs_new, [0.3, 0.3], 2, buffer="replay")
+    replay = buffer.replay
+    assert replay["reward"].tolist() == [0.5, 0.3, 0.2]
+    assert replay["iter"].tolist() == [0, 2, 0]
+    assert len(buffer.replay_trajs) == 3
+
+
+def test__add_replay__evicts_minimum(make_buffer, grid2d):
+    buffer = make_buffer(replay_capacity=2)
+    states, trajs = _states_and_trajs([[0, 0], [0, 1]])
+    buffer.add(states, trajs, [0.3, 0.6], 0, buffer="replay")
+    states, trajs = _states_and_trajs([[1, 1]])
+    buffer.add(states, trajs, [0.5], 1, buffer="replay")
+    replay = buffer.replay
+    assert replay["reward"].tolist() == [0.6, 0.5]
+    assert replay["state"].tolist() == [
+        grid2d.state2readable([0, 1]),
+        grid2d.state2readable([1, 1]),
+    ]
+    # A reward lower than the minimum in the buffer is not added
+    states, trajs = _states_and_trajs([[2, 2]])
+    buffer.add(states, trajs, [0.1], 2, buffer="replay")
+    assert buffer.replay["reward"].tolist() == [0.6, 0.5]
+    assert [2, 2] not in buffer.replay_states.values()
+
+
+def test__replay__dataframe_has_expected_format(make_buffer):
+    capacity = 4
+    buffer = make_buffer(replay_capacity=capacity)
+    states, trajs = _states_and_trajs([[0, 0], [0, 1], [1, 0]])
+    buffer.add(states, trajs, [0.2, 0.7, 0.5], 3, buffer="replay")
+    replay = buffer.replay
+    assert replay.columns.tolist() == ["state", "traj", "reward", "iter"]
+    assert replay["reward"].dtype == np.float64
+    assert replay["state"].dtype == object
+    assert replay["traj"].dtype == object
+    assert replay["iter"].dtype == object
+    assert len(replay) == capacity
+    assert sorted(replay.index.tolist()) == list(range(capacity))
+    assert replay["reward"].tolist() == [0.7, 0.5, 0.2, -1.0]
+    assert replay["iter"].tolist() == [3, 3, 3, None]
+
+
+def test__add_main__keeps_all_rows_in_insertion_order(make_buffer, grid2d):
+    buffer = make_buffer()
+    batches = [
+        ([[0, 0], [0, 1]], [0.5, 0.2]),
+        ([[1, 0]], [0.9]),
+        ([[1, 1], [2, 2], [0, 2]], [0.1, 0.7, 0.3]),
+    ]
+    states_expected, rewards_expected, iters_expected = [], [], []
+    for it, (states, rewards) in enumerate(batches):
+        states, trajs = _states_and_trajs(states)
+        buffer.add(states, trajs, rewards, it)
+        states_expected.extend([grid2d.state2readable(s) for s in states])
+        rewards_expected.extend(rewards)
+        iters_expected.extend([it] * len(states))
+        # Reading the main buffer after the first and second adds must not lose or
+        # reorder rows added afterwards
+        if it < 2:
+            main = buffer.main
+            assert main["state"].tolist() == states_expected
+            assert main["reward"].tolist() == rewards_expected
+    main = buffer.main
+    assert main.columns.tolist() == ["state", "traj", "reward", "iter"]
+    assert main["state"].tolist() == states_expected
+    assert main["reward"].tolist() == rewards_expected
+    assert main["iter"].tolist() == iters_expected
+    # Reading it again does not add any rows
+    assert len(buffer.main) == len(states_expected)
+
+
+@pytest.mark.parametrize(
+    "energies",
+    [
+        [0.5, 1.0, 2.0, -1.5],
+        [0.5, np.nan, 2.0, -1.5],
+        [np.nan, 0.3, 0.3, 4.0, np.nan],
+    ],
+)
+def test__compute_stats__matches_pandas(energies):
+    data = pd.DataFrame({"energies": energies})
+    mean, std, min_, max_, max_norm = Buffer.compute_stats(data)
+    mean_pd = data["energies"].mean()
+    std_pd = data["energies"].std()
+    assert np.isclose(mean, mean_pd)
+    assert np.isclose(std, std_pd)
+    assert np.isclose(min_, data["energies"].min())
+    assert np.isclose(max_, data["energies"].max())
+    assert np.isclose(max_norm, ((data["energies"] - mean_pd) / std_pd).max())